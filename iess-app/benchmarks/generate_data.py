@@ -0,0 +1,138 @@
+import os
+import shutil
+import argparse
+import numpy as np
+import pandas as pd
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+MAESTRO_FILES = [
+    "maestro_procedimientos.xlsx",
+    "maestro_medicamentos.xlsx",
+    "maestro_diagnosticos.xlsx",
+]
+
+FIRST_NAMES = [
+    "JOSE", "MARIA", "LUIS", "ANA", "CARLOS", "ROSA", "JUAN", "CARMEN", "JORGE", "LUCIA",
+    "MIGUEL", "GLORIA", "PEDRO", "FERNANDA", "DIEGO", "PAOLA", "RAFAEL", "ABRIL", "MATEO", "VALENTINA",
+]
+LAST_NAMES = [
+    "ZAMBRANO", "CEDEÑO", "MACIAS", "VERA", "MOREIRA", "CHUGCHO", "FLORES", "GARCIA", "MENDOZA", "LOPEZ",
+    "VILLACIS", "PAREDES", "TORRES", "ANDRADE", "SUAREZ", "CASTRO", "YEPEZ", "QUIÑONEZ", "BRAVO", "LEON",
+]
+INSUMOS = [
+    "GASA ESTERIL 10 X 10 CM", "JERINGA 5 ML", "EQUIPO DE VENOCLISIS", "CATETER INTRAVENOSO 22G",
+    "GUANTES DE EXAMINACION", "ESPARADRAPO 2.5 CM", "SOLUCION SALINA 0.9% 1000 ML", "SUTURA NYLON 3-0",
+]
+OBSERVACIONES = [
+    "PACIENTE ESTABLE", "SE REVISA HERIDA", "DRENAJE SIN NOVEDAD", "CONTROL EN 48 HORAS", "ALTA MEDICA",
+]
+DEPENDENCIAS = [142, 142, 142, 131, 155]
+
+
+def prepare_workdir(path):
+    # The app resolves the maestro files relative to the working directory
+    os.makedirs(path, exist_ok=True)
+    for name in MAESTRO_FILES:
+        shutil.copy(os.path.join(APP_DIR, name), os.path.join(path, name))
+    return path
+
+
+def load_catalogs():
+    proc_df = pd.read_excel(os.path.join(APP_DIR, "maestro_procedimientos.xlsx"))
+    med_df = pd.read_excel(os.path.join(APP_DIR, "maestro_medicamentos.xlsx"))
+    diag_df = pd.read_excel(os.path.join(APP_DIR, "maestro_diagnosticos.xlsx"))
+    return proc_df, med_df, diag_df
+
+
+def make_archivo_plano(n_rows, columns, catalogs, seed=0, month="2024-10"):
+    # Rows come in blocks like a real archivo plano: each patient has one or
+    # more stays, each stay one block per attention day, each block several
+    # procedure/medication/supply lines.
+    proc_df, med_df, diag_df = catalogs
+    rng = np.random.default_rng(seed)
+    month_start = pd.Timestamp(f"{month}-01")
+    days_in_month = month_start.days_in_month
+    rows = []
+    patient_no = 0
+    while len(rows) < n_rows:
+        patient_no += 1
+        name = " ".join([
+            rng.choice(LAST_NAMES), rng.choice(LAST_NAMES), rng.choice(FIRST_NAMES), rng.choice(FIRST_NAMES)
+        ])
+        patient = {
+            "CÓDIGO DEPENDENCIA\n(ESPECIALIDAD)\n": int(rng.choice(DEPENDENCIAS)),
+            "TIPO DE BENEFICIARIO": "AG",
+            "CEDULA": f"{rng.integers(1, 24):02d}{rng.integers(10**7, 10**8)}",
+            "NOMBRE DE BENEFICIARIO": name,
+            "SEXO-GENERO": rng.choice(["M", "F"]),
+            "FECHA DE NACIMIENTO BENEFICIERO": month_start - pd.Timedelta(days=int(rng.integers(100, 30000))),
+            "TIPO DE SERVICIO/ATENCION": rng.choice(["EMERGENCIA", "HOSPITALIZACION", "CONSULTA EXTERNA"]),
+        }
+        patient["EDAD BENEFICIERO"] = (month_start - patient["FECHA DE NACIMIENTO BENEFICIERO"]).days // 365
+        for _ in range(int(rng.integers(1, 3))):
+            ingreso = month_start + pd.Timedelta(days=int(rng.integers(0, days_in_month)))
+            egreso = min(ingreso + pd.Timedelta(days=int(rng.integers(0, 6))), month_start + pd.Timedelta(days=days_in_month - 1))
+            diag = diag_df.iloc[int(rng.integers(len(diag_df)))]
+            diag_sec = diag_df.iloc[int(rng.integers(len(diag_df)))]
+            for day in pd.date_range(ingreso, egreso):
+                for _ in range(int(rng.integers(2, 12))):
+                    kind = rng.random()
+                    if kind < 0.4:
+                        item = proc_df.iloc[int(rng.integers(len(proc_df)))]
+                        code, description = item["CÓDIGO"], item["DESCRIPCIÓN"]
+                    elif kind < 0.8:
+                        item = med_df.iloc[int(rng.integers(len(med_df)))]
+                        code, description = item["CÓDIGO"], item["DESCRIPCIÓN"]
+                    else:
+                        code, description = "", rng.choice(INSUMOS)
+                    quantity = int(rng.integers(1, 10))
+                    price = round(float(rng.uniform(0.5, 80)), 2)
+                    row = dict(patient)
+                    row.update({
+                        "FECHA ANTENCION": day,
+                        "FECHA DE INGRESO": ingreso,
+                        "FECHA DE EGRESO": egreso,
+                        "CODIGO": code,
+                        "DESCRIPCIÓN": description,
+                        "DIAGNOSTICO PRINCIPAL CIE-10": diag["CÓDIGO"],
+                        "DIAGNOSTICO PRESUNTIVO O DIFINITIVO": diag["NOMBRE"],
+                        "DIAGNSITICO SECUNDARIO 1": diag_sec["CÓDIGO"] if rng.random() < 0.3 else "",
+                        "CANTIDAD": quantity,
+                        "VALOR UNITARIO": price,
+                        "VALOR TOTAL": round(price * quantity, 2),
+                        "OBSERVACIONES\n": rng.choice(OBSERVACIONES) if rng.random() < 0.1 else "",
+                    })
+                    rows.append(row)
+    return pd.DataFrame(rows[:n_rows]).reindex(columns=columns)
+
+
+def data_file_path(n_rows, seed=0):
+    return os.path.join(DATA_DIR, f"archivo_plano_{n_rows}_s{seed}.xlsx")
+
+
+def ensure_data_file(n_rows, columns, catalogs, seed=0):
+    # Generated files are cached on disk; writing 100k rows to xlsx is slow
+    path = data_file_path(n_rows, seed)
+    if not os.path.exists(path):
+        os.makedirs(DATA_DIR, exist_ok=True)
+        frame = make_archivo_plano(n_rows, columns, catalogs, seed)
+        frame.to_excel(path + ".tmp.xlsx", index=False)
+        os.replace(path + ".tmp.xlsx", path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic archivo plano files for benchmarking.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    from run_benchmarks import import_app
+    columns = import_app().REQUIRED_COLUMNS
+    catalogs = load_catalogs()
+    for n_rows in args.rows:
+        print(ensure_data_file(n_rows, columns, catalogs, args.seed))
+
+
+if __name__ == "__main__":
+    main()
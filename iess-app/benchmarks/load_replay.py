@@ -0,0 +1,246 @@
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import httpx
+
+from generate_data import APP_DIR, prepare_workdir, load_catalogs, ensure_data_file
+from run_benchmarks import SEARCH_WORDS, import_app
+
+DEFAULT_MIX = "search=70,grid=15,add=12,upload=3"
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, key, elapsed, ok):
+        self.latencies.setdefault(key, []).append(elapsed)
+        if not ok:
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def report(self, wall_time):
+        endpoints = {}
+        total = 0
+        for key, samples in sorted(self.latencies.items()):
+            ms = np.array(samples) * 1000
+            total += len(samples)
+            endpoints[key] = {
+                "requests": len(samples),
+                "errors": self.errors.get(key, 0),
+                "error_rate": round(self.errors.get(key, 0) / len(samples), 4),
+                "throughput_rps": round(len(samples) / wall_time, 2),
+                "p50_ms": round(float(np.percentile(ms, 50)), 2),
+                "p95_ms": round(float(np.percentile(ms, 95)), 2),
+                "p99_ms": round(float(np.percentile(ms, 99)), 2),
+                "max_ms": round(float(ms.max()), 2),
+            }
+        return {
+            "wall_time_s": round(wall_time, 2),
+            "requests": total,
+            "errors": sum(self.errors.values()),
+            "throughput_rps": round(total / wall_time, 2) if wall_time else 0.0,
+            "endpoints": endpoints,
+        }
+
+
+async def send(client, stats, step):
+    key = f"{step['method']} {step['path']}"
+    start = time.perf_counter()
+    try:
+        response = await client.request(
+            step["method"], step["path"], params=step.get("params"), json=step.get("json"), files=step.get("files")
+        )
+        ok = response.status_code < 400
+    except httpx.HTTPError:
+        ok = False
+    stats.record(key, time.perf_counter() - start, ok)
+
+
+def scripted_steps(rng, mix, patients, upload_file, keystroke_delay):
+    # One unit of coder activity: a search-as-you-type burst, a grid
+    # refresh, an /add/ for a known patient, or a (rare) re-upload.
+    kinds, weights = zip(*mix.items())
+    kind = rng.choices(kinds, weights)[0]
+    if kind == "search":
+        path = rng.choice(list(SEARCH_WORDS))
+        word = rng.choice(SEARCH_WORDS[path])
+        return [
+            {"method": "GET", "path": path, "params": {"query": word[:i]}, "delay": keystroke_delay}
+            for i in range(1, len(word) + 1)
+        ]
+    if kind == "grid":
+        return [{"method": "GET", "path": "/data/"}]
+    if kind == "add":
+        entry = {
+            "paciente": rng.choice(patients),
+            "diagnostico_code": "J18",
+            "diagnostico_name": "NEUMONIA",
+            "procedimientos": [{"name": "CURACION", "code": "97597", "quantity": 1}],
+            "insumos": [{"name": "GASA ESTERIL", "code": "", "quantity": rng.randint(1, 5)}],
+        }
+        return [{"method": "POST", "path": "/add/", "json": entry}, {"method": "GET", "path": "/data/"}]
+    name, contents = upload_file
+    return [{"method": "POST", "path": "/upload/", "files": {"file": (name, contents)}}]
+
+
+async def scripted_user(user_id, client, stats, args, mix, patients, upload_file, deadline):
+    rng = random.Random(args.seed + user_id)
+    while time.perf_counter() < deadline:
+        for step in scripted_steps(rng, mix, patients, upload_file, args.keystroke_delay):
+            await send(client, stats, step)
+            await asyncio.sleep(step.get("delay", 0))
+        await asyncio.sleep(rng.expovariate(1 / args.think_time) if args.think_time else 0)
+
+
+async def replay_user(client, stats, steps, speed, deadline):
+    # Replays a recorded session, honouring the recorded offsets ("at")
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        for step in steps:
+            wait = started + step.get("at", 0) / speed - time.perf_counter()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            if time.perf_counter() >= deadline:
+                return
+            await send(client, stats, step)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers, storage):
+    workdir = prepare_workdir(tempfile.mkdtemp(prefix="iess-load-"))
+    port = free_port()
+    command = [
+        sys.executable, "-m", "uvicorn", "main:app", "--app-dir", APP_DIR,
+        "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning",
+    ]
+    if workers > 1:
+        command += ["--workers", str(workers)]
+    # Several workers need the shared SQLite store; with xlsx each would
+    # keep (and overwrite) its own copy of the data
+    process = subprocess.Popen(command, cwd=workdir, env=dict(os.environ, STORAGE_BACKEND=storage))
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("uvicorn exited during startup")
+        try:
+            response = httpx.get(url + "/health/ready", timeout=1)
+            if response.status_code == 200:
+                return process, url
+            if response.json().get("status") == "failed":
+                break
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("uvicorn did not become ready in time")
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        kind, weight = part.split("=")
+        mix[kind.strip()] = float(weight)
+    unknown = set(mix) - {"search", "grid", "add", "upload"}
+    if unknown:
+        raise SystemExit(f"Unknown mix entries: {', '.join(sorted(unknown))}")
+    return mix
+
+
+async def run(args, url):
+    catalogs = load_catalogs()
+    columns = import_app().REQUIRED_COLUMNS
+    data_path = ensure_data_file(args.rows, columns, catalogs, args.seed)
+    with open(data_path, "rb") as f:
+        upload_file = (os.path.basename(data_path), f.read())
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client:
+        # Seed the server with the synthetic month before the clock starts
+        response = await client.post("/upload/", files={"file": upload_file})
+        response.raise_for_status()
+        patients = sorted({row["NOMBRE DE BENEFICIARIO"] for row in (await client.get("/data/")).json()})
+        stats = Stats()
+        started = time.perf_counter()
+        deadline = started + args.duration
+        if args.replay:
+            with open(args.replay, encoding="utf-8") as f:
+                steps = [json.loads(line) for line in f if line.strip()]
+            users = [replay_user(client, stats, steps, args.speed, deadline) for _ in range(args.concurrency)]
+        else:
+            mix = parse_mix(args.mix)
+            users = [
+                scripted_user(i, client, stats, args, mix, patients, upload_file, deadline)
+                for i in range(args.concurrency)
+            ]
+        await asyncio.gather(*users)
+        return stats.report(time.perf_counter() - started)
+
+
+def print_report(report):
+    print(f"{report['requests']} requests in {report['wall_time_s']}s "
+          f"({report['throughput_rps']} req/s, {report['errors']} errors)")
+    print(f"{'endpoint':<36}{'reqs':>7}{'err%':>7}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for key, row in report["endpoints"].items():
+        print(f"{key:<36}{row['requests']:>7}{row['error_rate'] * 100:>7.1f}{row['throughput_rps']:>8.1f}"
+              f"{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay concurrent coder sessions against a local uvicorn instance.")
+    parser.add_argument("--url", help="target an already running server instead of starting one")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the started server")
+    parser.add_argument("--storage", choices=["xlsx", "sqlite"], help="STORAGE_BACKEND of the started server "
+                        "(default: sqlite with more than one worker, else xlsx)")
+    parser.add_argument("--concurrency", type=int, default=8, help="simultaneous coders")
+    parser.add_argument("--duration", type=float, default=60, help="seconds to run")
+    parser.add_argument("--rows", type=int, default=10000, help="size of the synthetic month uploaded first")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"scripted activity weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--think-time", type=float, default=2.0, help="mean pause between activities, seconds")
+    parser.add_argument("--keystroke-delay", type=float, default=0.12, help="pause between keystrokes, seconds")
+    parser.add_argument("--replay", help="JSON lines session recording ({at, method, path, params, json})")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the report as JSON")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+    if args.replay:
+        args.replay = os.path.abspath(args.replay)
+
+    args.storage = args.storage or ("sqlite" if args.workers > 1 else "xlsx")
+    process = None
+    url = args.url
+    if not url:
+        process, url = start_server(args.workers, args.storage)
+    try:
+        report = asyncio.run(run(args, url))
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+    report["config"] = {
+        key: getattr(args, key)
+        for key in ("concurrency", "duration", "rows", "mix", "think_time", "keystroke_delay", "replay", "workers", "storage", "seed")
+    }
+    print_report(report)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
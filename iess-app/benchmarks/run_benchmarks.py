@@ -0,0 +1,218 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import importlib
+import resource
+import tempfile
+import subprocess
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+from generate_data import APP_DIR, prepare_workdir, load_catalogs, ensure_data_file
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# Search-as-you-type: every prefix of these words is sent, as the frontend does
+SEARCH_WORDS = {
+    "/search/diagnostics/": ["diabetes", "neumonia", "fractura", "hipertension"],
+    "/search/diagnostics/code/": ["e11", "j18", "s52", "i10"],
+    "/search/procedures/": ["drenaje", "curacion", "consulta", "radiografia"],
+    "/search/medications/": ["paracetamol", "ibuprofeno", "amoxicilina", "omeprazol"],
+}
+
+
+def import_app(workdir=None):
+    # main.py reads its catalogs and data.xlsx from the working directory
+    # (in warm_up(), after startup), so it is imported from a scratch directory.
+    workdir = prepare_workdir(workdir or tempfile.mkdtemp(prefix="iess-bench-"))
+    os.chdir(workdir)
+    if APP_DIR not in sys.path:
+        sys.path.insert(0, APP_DIR)
+    if "main" in sys.modules:
+        # The previous instance's Excel worker processes (and SQLite
+        # connection) would otherwise linger
+        sys.modules["main"].shutdown_excel_pool()
+        sys.modules["main"].close_store()
+        return importlib.reload(sys.modules["main"])
+    return importlib.import_module("main")
+
+
+def wait_ready(client, timeout=300):
+    # The TestClient runs the startup hook, which warms up in the background
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        response = client.get("/health/ready")
+        if response.status_code == 200:
+            return
+        if response.json().get("status") == "failed":
+            raise RuntimeError(f"warm-up failed: {response.json().get('error')}")
+        time.sleep(0.05)
+    raise RuntimeError("app did not become ready in time")
+
+
+def summarize(samples):
+    ms = np.array(samples) * 1000
+    return {
+        "n": len(samples),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def measure(calls, repeat):
+    # calls is a list of zero-argument callables; each is timed `repeat`
+    # times. Peak allocation comes from one extra run under tracemalloc so
+    # tracing overhead does not leak into the timings.
+    samples = []
+    for _ in range(repeat):
+        for call in calls:
+            start = time.perf_counter()
+            call()
+            samples.append(time.perf_counter() - start)
+    tracemalloc.start()
+    calls[0]()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result = summarize(samples)
+    result["peak_alloc_bytes"] = peak
+    return result
+
+
+def checked(response):
+    if response.status_code >= 400:
+        raise RuntimeError(f"{response.request.method} {response.request.url} -> {response.status_code}: {response.text[:200]}")
+    return response
+
+
+def bench_catalog_load(repeat):
+    # "import" is the time until uvicorn could bind; "startup" adds the
+    # catalog/data warm-up that runs in the background in production
+    imports, startups = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        app_module = import_app()
+        imports.append(time.perf_counter() - start)
+        app_module.warm_up()
+        startups.append(time.perf_counter() - start)
+    return {"import": summarize(imports), "startup": summarize(startups)}
+
+
+def bench_dataset(app_module, client, data_path, repeat, read_repeat):
+    results = {}
+    with open(data_path, "rb") as f:
+        contents = f.read()
+    filename = os.path.basename(data_path)
+
+    def upload():
+        checked(client.post("/upload/", files={"file": (filename, contents)}))
+
+    results["upload_file"] = measure([upload], repeat)
+    # Re-merging the same month: every row matches and nothing changes
+    results["upload_merge"] = measure(
+        [lambda: checked(client.post("/upload/", params={"mode": "merge"}, files={"file": (filename, contents)}))], repeat
+    )
+    results["get_data"] = measure([lambda: checked(client.get("/data/"))], read_repeat)
+
+    for path, words in SEARCH_WORDS.items():
+        queries = [word[:i] for word in words for i in range(1, len(word) + 1)]
+        calls = [lambda q=q, path=path: checked(client.get(path, params={"query": q})) for q in queries]
+        results[f"search {path}"] = measure(calls, max(read_repeat // 10, 1))
+
+    df = app_module.df
+    patient = df["NOMBRE DE BENEFICIARIO"].iloc[len(df) // 2]
+    entry = {
+        "paciente": patient,
+        "diagnostico_code": "J18",
+        "diagnostico_name": "NEUMONIA",
+        "procedimientos": [{"name": "CURACION", "code": "97597", "quantity": 1}],
+        "medicamentos": [{"name": "PARACETAMOL", "code": "3213801007001", "quantity": 2}],
+        "insumos": [{"name": "GASA ESTERIL", "code": "", "quantity": 3}],
+    }
+    results["add_entry"] = measure([lambda: checked(client.post("/add/", json=entry))], repeat)
+    results["delete_rows"] = measure(
+        [lambda: checked(client.post("/delete/", json={"ids": [len(app_module.df) // 2, 1, 0]}))], repeat
+    )
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def compare(old_path, new_results):
+    with open(old_path, encoding="utf-8") as f:
+        old_results = json.load(f)["results"]
+    print(f"{'benchmark':<55}{'old p50':>12}{'new p50':>12}{'change':>10}")
+    for size, benches in new_results.items():
+        for name, stats in benches.items():
+            old = old_results.get(size, {}).get(name)
+            if not old:
+                continue
+            change = (stats["p50_ms"] - old["p50_ms"]) / old["p50_ms"] * 100 if old["p50_ms"] else 0.0
+            print(f"{size + ' ' + name:<55}{old['p50_ms']:>12.2f}{stats['p50_ms']:>12.2f}{change:>+9.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the FastAPI backend hot paths offline.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000],
+                        help="archivo plano sizes to run (100000 is supported but slow)")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions for mutating endpoints")
+    parser.add_argument("--read-repeat", type=int, default=50, help="repetitions for read endpoints")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="result file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="previous result file to compare p50s against")
+    args = parser.parse_args()
+    # import_app() changes the working directory
+    output = os.path.abspath(args.output) if args.output else None
+    previous = os.path.abspath(args.compare) if args.compare else None
+
+    from fastapi.testclient import TestClient
+
+    catalogs = load_catalogs()
+    results = {"catalog_load": bench_catalog_load(3)}
+    for size in args.sizes:
+        app_module = import_app()
+        data_path = ensure_data_file(size, app_module.REQUIRED_COLUMNS, catalogs, args.seed)
+        with TestClient(app_module.app) as client:
+            wait_ready(client)
+            results[str(size)] = bench_dataset(app_module, client, data_path, args.repeat, args.read_repeat)
+        print(f"{size} rows done", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "read_repeat": args.read_repeat,
+            "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        },
+        "results": results,
+    }
+    output = output or os.path.join(RESULTS_DIR, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(output)
+    if previous:
+        compare(previous, results)
+
+
+if __name__ == "__main__":
+    main()
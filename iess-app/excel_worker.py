@@ -0,0 +1,79 @@
+import os
+import time
+from io import BytesIO
+from functools import lru_cache
+import pandas as pd
+
+# Excel parsing and workbook writing, run in the worker processes started by
+# main.py (or inline when EXCEL_WORKERS=0). Frames travel as a columnar
+# snapshot, a list of column labels plus one numpy array per column, and every
+# job returns the time spent in each phase so the caller can record it.
+
+# (color, pattern) per band, used in turn: a row in band b gets
+# COLOR_BANDS[b % len(COLOR_BANDS)]. openpyxl is only imported when a
+# workbook is first colored
+COLOR_BANDS = [
+    ("FF92D050", "darkGrid"),
+    ("FF00B0F0", "darkTrellis"),
+    ("FFFFC000", "lightGrid"),
+    ("FF7030A0", "lightTrellis"),
+    ("FF00B050", "darkHorizontal"),
+    ("FFED7D31", "darkVertical"),
+    ("FFFF0000", "lightHorizontal"),
+    ("FF4472C4", "lightVertical"),
+    ("FFBFBFBF", "darkDown"),
+    ("FFFF00FF", "darkUp"),
+]
+
+@lru_cache(maxsize=1)
+def get_color_fills():
+    from openpyxl.styles import PatternFill
+    return [PatternFill(start_color=color, end_color=color, fill_type=pattern) for color, pattern in COLOR_BANDS]
+
+def to_columns(frame):
+    return list(frame.columns), [frame[col].to_numpy() for col in frame.columns]
+
+def from_columns(columns, arrays):
+    return pd.DataFrame({i: array for i, array in enumerate(arrays)}).set_axis(columns, axis=1)
+
+def color_rows(ws, bands, width):
+    # bands holds the color band id of each data row (sheet row 2 onwards).
+    # Every band of a colour shares one PatternFill; only the fill of each
+    # cell changes, so date cells keep their number format.
+    fills = get_color_fills()
+    rows = ws.iter_rows(min_row=2, max_row=len(bands) + 1, max_col=width)
+    for cells, band in zip(rows, bands.tolist()):
+        fill = fills[band % len(fills)]
+        for cell in cells:
+            cell.fill = fill
+
+def write_workbook(path, columns, arrays, bands=None):
+    # With bands the rows are colored before the workbook is first saved, so
+    # it is written once and never read back
+    phases = {}
+    start = time.perf_counter()
+    with pd.ExcelWriter(path, engine="openpyxl") as writer:
+        from_columns(columns, arrays).to_excel(writer, index=False)
+        phases["to_excel"] = time.perf_counter() - start
+        if bands is not None:
+            start = time.perf_counter()
+            color_rows(writer.sheets["Sheet1"], bands, len(columns))
+            phases["fill_loop"] = time.perf_counter() - start
+        start = time.perf_counter()
+    phases["wb_save"] = time.perf_counter() - start
+    return {"phases": phases, "bytes": os.path.getsize(path)}
+
+def read_table(source, filename=None):
+    # source is a path or the uploaded file contents
+    filename = filename or source
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+    start = time.perf_counter()
+    if filename.lower().endswith(".csv"):
+        phase = "read_csv"
+        frame = pd.read_csv(source)
+    else:
+        phase = "read_excel"
+        frame = pd.read_excel(source)
+    columns, arrays = to_columns(frame)
+    return {"phases": {phase: time.perf_counter() - start}, "columns": columns, "arrays": arrays}
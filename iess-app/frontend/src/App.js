@@ -524,7 +524,7 @@ function App() {
           </thead>
           <tbody>
             {gridData.map(row => (
-              <tr key={row.id} onClick={() => handleRowClick(row)}>
+              <tr key={row.id} className={row.band % 2 ? "band-odd" : undefined} onClick={() => handleRowClick(row)}>
                 <td>
                   <input
                     type="checkbox"
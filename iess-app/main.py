@@ -1,17 +1,44 @@
 import os
+import re
 import sys
 import json
 import math
+import mmap
+import heapq
+import unicodedata
+import gzip
+import shutil
+import time
+import bisect
+import random
+import pstats
+import cProfile
+import logging
+import functools
+import contextvars
+import resource
+import tracemalloc
+import asyncio
+import sqlite3
+import threading
+import multiprocessing
+import numpy as np
 import pandas as pd
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Header, Query, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.routing import APIRoute
+from starlette.routing import Match
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response
 from pydantic import BaseModel
-from openpyxl import load_workbook
-from openpyxl.styles import PatternFill
-from io import BytesIO
+from io import StringIO
 from functools import lru_cache
+from collections import Counter, OrderedDict
+from contextlib import contextmanager, nullcontext
+from logging.handlers import RotatingFileHandler
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from fastapi.staticfiles import StaticFiles
+import excel_worker
 
 app = FastAPI()
 
@@ -27,6 +54,134 @@ app.add_middleware(
     expose_headers=["*"]
 )
 
+# ==========================
+# Metrics
+# ==========================
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Histogram:
+    # Fixed-bucket histogram; observe() only bumps preallocated counters
+    __slots__ = ("buckets", "sum", "count")
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+metrics_lock = threading.Lock()
+request_histograms = {}
+request_counts = {}
+phase_histograms = {}
+requests_in_flight = 0
+
+def observe_phase(phase, seconds):
+    with metrics_lock:
+        histogram = phase_histograms.get(phase)
+        if histogram is None:
+            histogram = phase_histograms[phase] = Histogram()
+        histogram.observe(seconds)
+
+# Per-request trace of a mutation: one JSON line with every timed phase, row
+# counts and byte sizes, written to a local rotating file.
+TRACE_LOG_FILE = os.environ.get("TRACE_LOG_FILE", os.path.join("logs", "mutations.log"))
+trace_logger = logging.getLogger("iess.trace")
+trace_logger.propagate = False
+trace_logger.setLevel(logging.INFO)
+if TRACE_LOG_FILE and not trace_logger.handlers:
+    os.makedirs(os.path.dirname(TRACE_LOG_FILE) or ".", exist_ok=True)
+    trace_handler = RotatingFileHandler(TRACE_LOG_FILE, maxBytes=10 * 1024 * 1024, backupCount=5, delay=True)
+    trace_handler.setFormatter(logging.Formatter("%(message)s"))
+    trace_logger.addHandler(trace_handler)
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+def record_phase(phase, seconds):
+    observe_phase(phase, seconds)
+    trace = current_trace.get()
+    if trace is not None:
+        trace["spans"].append({"phase": phase, "ms": round(seconds * 1000, 3)})
+
+@contextmanager
+def timed_phase(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(phase, time.perf_counter() - start)
+
+def trace_set(**fields):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.update(fields)
+
+@contextmanager
+def traced_request(operation):
+    trace = {"ts": time.strftime("%Y-%m-%dT%H:%M:%S"), "operation": operation, "spans": []}
+    token = current_trace.set(trace)
+    start = time.perf_counter()
+    try:
+        yield trace
+        trace["status"] = "ok"
+    except Exception as e:
+        trace["status"] = "error"
+        trace["error"] = getattr(e, "detail", None) or str(e)
+        raise
+    finally:
+        current_trace.reset(token)
+        trace["total_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        trace_logger.info(json.dumps(trace, ensure_ascii=False, default=str))
+
+def route_label(scope):
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    # Answered before routing (503 while warming up): the route it was meant for
+    for candidate in app.routes:
+        if isinstance(candidate, APIRoute) and candidate.matches(scope)[0] == Match.FULL:
+            return candidate.path
+    return "unmatched"
+
+class MetricsMiddleware:
+    # Plain ASGI middleware (no per-request Request/Response objects). Added
+    # last, so it is the outermost layer and times every other middleware too.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global requests_in_flight
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        with metrics_lock:
+            requests_in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            key = (scope["method"], route_label(scope))
+            with metrics_lock:
+                requests_in_flight -= 1
+                histogram = request_histograms.get(key)
+                if histogram is None:
+                    histogram = request_histograms[key] = Histogram()
+                histogram.observe(elapsed)
+                count_key = key + (status_code,)
+                request_counts[count_key] = request_counts.get(count_key, 0) + 1
+
 def resource_path(relative_path):
     try:
         base_path = sys._MEIPASS
@@ -48,28 +203,409 @@ def normalize_dataframe(df, required_cols):
     df = df[required_cols]
     return df
 
+def set_cell(df, row_id, column, value):
+    # Upcast to object only when the column cannot hold the new value as-is
+    if isinstance(value, np.integer):
+        value = int(value)
+    series = df[column]
+    if series.dtype != object:
+        fits = (
+            isinstance(value, (int, float)) and not isinstance(value, bool)
+            and (pd.api.types.is_float_dtype(series) or
+                 (pd.api.types.is_integer_dtype(series) and isinstance(value, int)))
+        ) or (series.dtype.kind == "M" and (isinstance(value, pd.Timestamp) or value is pd.NaT))
+        if not fits:
+            df[column] = series.astype(object)
+    df.iat[row_id, df.columns.get_loc(column)] = value
+
+# ==========================
+# Excel worker pool
+# ==========================
+# Parsing and writing workbooks holds the GIL for seconds, so it runs in
+# worker processes (excel_worker.py) and the calling thread just waits. At
+# most EXCEL_WORKERS jobs run and EXCEL_QUEUE_SIZE more wait; beyond that a
+# caller waits up to EXCEL_QUEUE_TIMEOUT seconds for a slot and then gets a
+# 503. EXCEL_WORKERS=0 runs the jobs inline.
+EXCEL_WORKERS = int(os.environ.get("EXCEL_WORKERS", "1"))
+EXCEL_QUEUE_SIZE = int(os.environ.get("EXCEL_QUEUE_SIZE", "4"))
+EXCEL_QUEUE_TIMEOUT = float(os.environ.get("EXCEL_QUEUE_TIMEOUT", "30"))
+excel_pool = None
+excel_pool_lock = threading.Lock()
+excel_slots = threading.BoundedSemaphore(max(EXCEL_WORKERS, 1) + EXCEL_QUEUE_SIZE)
+
+def get_excel_pool():
+    global excel_pool
+    with excel_pool_lock:
+        if excel_pool is None:
+            # spawn, not fork: the server process has running threads
+            excel_pool = ProcessPoolExecutor(EXCEL_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return excel_pool
+
+def shutdown_excel_pool():
+    global excel_pool
+    with excel_pool_lock:
+        if excel_pool is not None:
+            excel_pool.shutdown(wait=True, cancel_futures=True)
+            excel_pool = None
+
+# True while the current request holds a slot taken by excel_slot()
+excel_slot_held = contextvars.ContextVar("excel_slot_held", default=False)
+
+@contextmanager
+def excel_slot():
+    # Holds one place in the Excel queue for the jobs run inside the block.
+    # Mutations that rewrite DATA_FILE take it before touching df, so a full
+    # queue is refused with 503 while nothing has changed yet.
+    if excel_slot_held.get():
+        yield
+        return
+    with timed_phase("excel_queue_wait"):
+        acquired = excel_slots.acquire(timeout=EXCEL_QUEUE_TIMEOUT)
+    if not acquired:
+        raise HTTPException(status_code=503, detail="Excel workers are busy, try again shortly", headers={"Retry-After": "5"})
+    token = excel_slot_held.set(True)
+    try:
+        yield
+    finally:
+        excel_slot_held.reset(token)
+        excel_slots.release()
+
+def run_excel_job(func, *args):
+    global excel_pool
+    with excel_slot():
+        start = time.perf_counter()
+        if EXCEL_WORKERS > 0:
+            pool = get_excel_pool()
+            try:
+                result = pool.submit(func, *args).result()
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory); start fresh next time
+                with excel_pool_lock:
+                    if excel_pool is pool:
+                        excel_pool = None
+                raise
+        else:
+            result = func(*args)
+    elapsed = time.perf_counter() - start
+    for phase, seconds in result["phases"].items():
+        record_phase(phase, seconds)
+    # Pickling the snapshot to the worker and the result back
+    record_phase("excel_transfer", max(elapsed - sum(result["phases"].values()), 0.0))
+    return result
+
+def read_table(source, filename=None):
+    result = run_excel_job(excel_worker.read_table, source, filename)
+    return excel_worker.from_columns(result["columns"], result["arrays"])
+
 # ==========================
 # Load Maestro Files
 # ==========================
-try:
-    proc_df = pd.read_excel(resource_path("maestro_procedimientos.xlsx"))
-    med_df = pd.read_excel(resource_path("maestro_medicamentos.xlsx"))
-    diag_df = pd.read_excel(resource_path("maestro_diagnosticos.xlsx"))
-except Exception as e:
-    raise HTTPException(status_code=500, detail=f"Error loading maestro files: {e}")
-
-# Build medication 'concat' field using real column names:
-med_df["concat"] = (
-    med_df["CÓDIGO"].astype(str) + " - " +
-    med_df["DESCRIPCIÓN"].astype(str) + " " +
-    med_df["PRINCIPIO ACTIVO"].astype(str) + " " +
-    med_df["FORMA FARMACEUTICA"].astype(str) + " " +
-    med_df["CONCENTRACION"].astype(str) + " " +
-    med_df["PRESENTACION"].astype(str) + " " +
-    med_df["VIA ADMINISTRACION"].astype(str)
-)
+# The catalogs live in one snapshot dict that is only ever replaced, never
+# modified: load_catalogs() attaches the new catalog files next to the current
+# snapshot and swaps it in with a single assignment, so a request that already
+# took a reference keeps a consistent (old) catalog. Readers must take the
+# snapshot once per request via `catalog = catalogs`.
+MAESTRO_FILES = {
+    "procedimientos": "maestro_procedimientos.xlsx",
+    "medicamentos": "maestro_medicamentos.xlsx",
+    "diagnosticos": "maestro_diagnosticos.xlsx",
+}
+MED_CONCAT_COLUMNS = [
+    "CÓDIGO", "DESCRIPCIÓN", "PRINCIPIO ACTIVO", "FORMA FARMACEUTICA",
+    "CONCENTRACION", "PRESENTACION", "VIA ADMINISTRACION",
+]
+catalog_reload_lock = threading.Lock()
+
+def load_catalog(name):
+    frame = read_table(resource_path(MAESTRO_FILES[name]))
+    if name == "medicamentos":
+        # Build medication 'concat' field using real column names:
+        frame["concat"] = (
+            frame["CÓDIGO"].astype(str) + " - " +
+            frame["DESCRIPCIÓN"].astype(str) + " " +
+            frame["PRINCIPIO ACTIVO"].astype(str) + " " +
+            frame["FORMA FARMACEUTICA"].astype(str) + " " +
+            frame["CONCENTRACION"].astype(str) + " " +
+            frame["PRESENTACION"].astype(str) + " " +
+            frame["VIA ADMINISTRACION"].astype(str)
+        )
+    return frame
+
+def catalog_full_records(name, frame):
+    # Precomputed payload of the /<catalog>/full/ endpoints
+    out = []
+    if name == "medicamentos":
+        for _, row in frame.iterrows():
+            code_val = row["CÓDIGO"] if pd.notnull(row["CÓDIGO"]) else row["concat"].split(" - ")[0]
+            out.append({
+                "concat": row["concat"],
+                "CODIGO": str(code_val)
+            })
+    elif name == "procedimientos":
+        for _, row in frame.iterrows():
+            out.append({
+                "DESCRIPCIÓN": row["DESCRIPCIÓN"],
+                "CÓDIGO": str(row["CÓDIGO"])
+            })
+    else:
+        for _, row in frame.iterrows():
+            out.append({
+                "NOMBRE": row["NOMBRE"],
+                "CÓDIGO": str(row["CÓDIGO"])
+            })
+    return out
+
+# search name -> (catalog, column) matched by the /search/* endpoints
+SEARCH_FIELDS = {
+    "diagnostics": ("diagnosticos", "NOMBRE"),
+    "diagnostics_code": ("diagnosticos", "CÓDIGO"),
+    "procedures": ("procedimientos", "DESCRIPCIÓN"),
+    "medications": ("medicamentos", "concat"),
+}
+
+def catalog_search_texts(name, frame):
+    # Lowercased text per row for each searched column (None = never matches)
+    texts = {}
+    for catalog, column in SEARCH_FIELDS.values():
+        if catalog != name:
+            continue
+        if column == "CÓDIGO":
+            texts[column] = frame[column].astype(str).str.lower().tolist()
+        else:
+            texts[column] = [value.lower() if isinstance(value, str) else None for value in frame[column]]
+    return texts
+
+# ==========================
+# Shared catalog files
+# ==========================
+# Each catalog is written once per host to CATALOG_CACHE_DIR as a read-only
+# columnar file and memory-mapped by every process that needs it, so all
+# uvicorn workers share the same pages through the OS page cache instead of
+# holding their own frames. The file name carries the maestro file's mtime
+# and size: a worker that finds it already written just attaches it.
+#
+# Layout: two int64s (header offset and length), 8-byte aligned buffers, then
+# a JSON header. Every column is an Arrow-style string column: int64 offsets,
+# a uint8 kind per row (null/str/int/float) and UTF-8 data with a NUL byte
+# before and after each value (row i is data[offsets[i]:offsets[i + 1] - 1]).
+# The searched columns are stored again lowercased, so a search is one scan
+# over a single buffer (a match cannot cross a NUL). The /<catalog>/full/
+# response is stored as JSON.
+CATALOG_CACHE_DIR = os.environ.get("CATALOG_CACHE_DIR", "catalog_cache")
+CATALOG_FILE_FORMAT = 1
+VALUE_NULL, VALUE_STR, VALUE_INT, VALUE_FLOAT = 0, 1, 2, 3
+
+def encode_column(values):
+    kinds = np.zeros(len(values), dtype=np.uint8)
+    parts = []
+    for i, value in enumerate(values):
+        if value is None or value is pd.NaT or (isinstance(value, float) and math.isnan(value)):
+            parts.append(b"")
+            continue
+        if isinstance(value, (int, np.integer)) and not isinstance(value, (bool, np.bool_)):
+            kinds[i], text = VALUE_INT, str(int(value))
+        elif isinstance(value, (float, np.floating)):
+            kinds[i], text = VALUE_FLOAT, repr(float(value))
+        else:
+            kinds[i], text = VALUE_STR, str(value)
+        parts.append(text.replace("\x00", "").encode("utf-8"))
+    offsets = np.empty(len(parts) + 1, dtype=np.int64)
+    offsets[0] = 1
+    np.cumsum([len(part) + 1 for part in parts], out=offsets[1:])
+    offsets[1:] += 1
+    return offsets, kinds, b"\x00" + b"".join(part + b"\x00" for part in parts)
+
+def encode_catalog(frame, search_texts, full):
+    buffers, header = [], {"format": CATALOG_FILE_FORMAT, "rows": len(frame), "columns": {}, "search": {}}
+    position = 16
+
+    def add(data):
+        nonlocal position
+        buffers.append(data)
+        spec = [position, len(data)]
+        position += len(data)
+        padding = -position % 8
+        buffers.append(b"\x00" * padding)
+        position += padding
+        return spec
+
+    def add_column(values):
+        offsets, kinds, data = encode_column(values)
+        return {"offsets": add(offsets.tobytes()), "kinds": add(kinds.tobytes()), "data": add(data)}
+
+    for col in frame.columns:
+        header["columns"][col] = add_column(frame[col].tolist())
+    for col, texts in search_texts.items():
+        header["search"][col] = add_column(texts)
+    header["full"] = add(json.dumps(full, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8"))
+    encoded = json.dumps(header).encode("utf-8")
+    prefix = np.array([position, len(encoded)], dtype=np.int64).tobytes()
+    return prefix + b"".join(buffers) + encoded
+
+class SharedCatalog:
+    # Read-only view of an encoded catalog (a memory-mapped file, or bytes for
+    # the empty placeholder). Column arrays are numpy views into the buffer;
+    # values are only decoded for the rows a request returns.
+    def __init__(self, buffer, path=None):
+        self.buffer = buffer
+        self.path = path
+        header_at, header_len = np.frombuffer(buffer, dtype=np.int64, count=2).tolist()
+        self.header = json.loads(bytes(buffer[header_at:header_at + header_len]))
+        self.rows = self.header["rows"]
+        self.columns = list(self.header["columns"])
+        self.views = {
+            (section, col): self.column_view(spec)
+            for section in ("columns", "search") for col, spec in self.header[section].items()
+        }
+
+    def column_view(self, spec):
+        offsets = np.frombuffer(self.buffer, dtype=np.int64, count=spec["offsets"][1] // 8, offset=spec["offsets"][0])
+        kinds = np.frombuffer(self.buffer, dtype=np.uint8, count=spec["kinds"][1], offset=spec["kinds"][0])
+        return offsets, kinds, spec["data"][0], spec["data"][0] + spec["data"][1]
+
+    def __len__(self):
+        return self.rows
+
+    @property
+    def nbytes(self):
+        return len(self.buffer)
+
+    def value(self, col, row):
+        offsets, kinds, start, _ = self.views[("columns", col)]
+        kind = kinds[row]
+        if kind == VALUE_NULL:
+            return None
+        text = self.buffer[start + offsets[row]:start + offsets[row + 1] - 1].decode("utf-8")
+        return int(text) if kind == VALUE_INT else float(text) if kind == VALUE_FLOAT else text
+
+    def records(self, rows, columns):
+        return [{col: self.value(col, row) for col in columns} for row in rows]
+
+    def find(self, col, query, candidates=None):
+        # Rows whose lowercased col contains query, in catalog order. The
+        # pattern runs on to the row's closing NUL, so each row matches once
+        # and only the match starts are mapped to rows. With a few candidate
+        # rows (a cached prefix's matches) only those rows are checked, which
+        # beats rescanning the column up to about one row per KB of text.
+        offsets, kinds, start, end = self.views[("search", col)]
+        needle = query.encode("utf-8")
+        if b"\x00" in needle:
+            return np.array([], dtype=np.int64)
+        if not needle:
+            found = np.flatnonzero(kinds != VALUE_NULL)
+            return found if candidates is None else np.intersect1d(candidates, found)
+        if candidates is not None and len(candidates) < (end - start) // 1024:
+            find = self.buffer.find
+            return np.array([
+                row for row in candidates.tolist()
+                if find(needle, start + int(offsets[row]), start + int(offsets[row + 1]) - 1) != -1
+            ], dtype=np.int64)
+        pattern = re.compile(re.escape(needle) + b"[^\x00]*")
+        positions = np.array([match.start() for match in pattern.finditer(self.buffer, start, end)], dtype=np.int64)
+        return np.searchsorted(offsets, positions - start, side="right") - 1
+
+    def find_exact(self, col, value, search=False):
+        # First row whose col (lowercased with search=True) equals value, or -1
+        offsets, _, start, end = self.views[("search" if search else "columns", col)]
+        position = self.buffer.find(b"\x00" + value.encode("utf-8") + b"\x00", start, end)
+        if position == -1:
+            return -1
+        return int(np.searchsorted(offsets, position - start + 1))
+
+    def full_json(self):
+        start, length = self.header["full"]
+        return bytes(self.buffer[start:start + length])
+
+def catalog_file_path(name):
+    stat = os.stat(resource_path(MAESTRO_FILES[name]))
+    return os.path.join(CATALOG_CACHE_DIR, f"{name}-{stat.st_mtime_ns}-{stat.st_size}-f{CATALOG_FILE_FORMAT}.bin")
+
+def build_catalog_file(name, path):
+    # Written to a temporary name and renamed, so a worker never maps a
+    # partial file; two workers building at once write identical contents
+    frame = load_catalog(name)
+    full = [
+        {key: None if isinstance(value, float) and math.isnan(value) else value for key, value in record.items()}
+        for record in catalog_full_records(name, frame)
+    ]
+    os.makedirs(CATALOG_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(encode_catalog(frame, catalog_search_texts(name, frame), full))
+    os.replace(tmp_path, path)
+    # Files of older maestro versions; workers still mapping one keep it
+    # until they reload (removal fails on Windows while mapped)
+    for other in os.listdir(CATALOG_CACHE_DIR):
+        if other.startswith(f"{name}-") and other.endswith(".bin") and other != os.path.basename(path):
+            try:
+                os.remove(os.path.join(CATALOG_CACHE_DIR, other))
+            except OSError:
+                pass
+
+def attach_catalog(path):
+    with open(path, "rb") as f:
+        return SharedCatalog(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), path)
+
+def empty_catalog(name, columns):
+    frame = pd.DataFrame(columns=columns)
+    return SharedCatalog(encode_catalog(frame, catalog_search_texts(name, frame), []))
+
+# Empty until warm_up() has attached the files
+catalogs = {
+    "version": 0,
+    "loaded_at": None,
+    "mtimes": {},
+    "procedimientos": empty_catalog("procedimientos", ["CÓDIGO", "DESCRIPCIÓN"]),
+    "medicamentos": empty_catalog("medicamentos", MED_CONCAT_COLUMNS + ["concat"]),
+    "diagnosticos": empty_catalog("diagnosticos", ["NOMBRE", "CÓDIGO"]),
+}
+
+def load_catalogs(force=False, progress=None):
+    # Reattaches the catalogs whose file changed (all of them with force, which
+    # also rebuilds their catalog files) and swaps in a new snapshot. Returns
+    # the names that were reloaded. If a file fails to load the exception
+    # propagates and the current snapshot stays.
+    global catalogs
+    with catalog_reload_lock:
+        current = catalogs
+        new = {"version": current["version"], "loaded_at": current["loaded_at"], "mtimes": {}}
+        reloaded = []
+        for name, filename in MAESTRO_FILES.items():
+            # mtime is taken before reading, so a write during the read is
+            # picked up by the next reload
+            mtime = os.path.getmtime(resource_path(filename))
+            if not force and current["mtimes"].get(name) == mtime:
+                new[name] = current[name]
+            else:
+                if progress:
+                    progress(name, "loading")
+                start = time.perf_counter()
+                path = catalog_file_path(name)
+                built = force or not os.path.exists(path)
+                with timed_phase("catalog_load"):
+                    if built:
+                        build_catalog_file(name, path)
+                    new[name] = attach_catalog(path)
+                reloaded.append(name)
+                if progress:
+                    progress(name, "done", rows=len(new[name]), built=built, seconds=round(time.perf_counter() - start, 3))
+            new["mtimes"][name] = mtime
+        if reloaded:
+            new["version"] += 1
+            new["loaded_at"] = time.time()
+            catalogs = new
+        return reloaded
 
 DATA_FILE = "data.xlsx"
+# "xlsx" keeps DATA_FILE as the data itself; "sqlite" keeps the rows in
+# SQLITE_FILE and only writes DATA_FILE on /save/ (see "SQLite store" below)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "xlsx")
+if STORAGE_BACKEND not in ("xlsx", "sqlite"):
+    raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+SQLITE_FILE = os.environ.get("SQLITE_FILE", "data.sqlite")
+# Cell edits are appended here instead of rewriting DATA_FILE; the journal is
+# replayed on startup and cleared whenever DATA_FILE is written in full.
+JOURNAL_FILE = "data.journal"
 
 REQUIRED_COLUMNS = [
     'CÓDIGO DEPENDENCIA\n(ESPECIALIDAD)\n',
@@ -117,12 +653,502 @@ REQUIRED_COLUMNS = [
     'OBSERVACIONES\n'
 ]
 
-if os.path.exists(DATA_FILE):
-    df = pd.read_excel(DATA_FILE)
-    df.columns = df.columns.str.strip()
-    df = normalize_dataframe(df, REQUIRED_COLUMNS)
-else:
-    df = pd.DataFrame(columns=REQUIRED_COLUMNS)
+def load_data_file():
+    if not os.path.exists(DATA_FILE):
+        return pd.DataFrame(columns=REQUIRED_COLUMNS)
+    frame = read_table(DATA_FILE)
+    frame.columns = frame.columns.str.strip()
+    return replay_journal(normalize_dataframe(frame, REQUIRED_COLUMNS))
+
+def replay_journal(df):
+    if not os.path.exists(JOURNAL_FILE):
+        return df
+    with open(JOURNAL_FILE, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            change = json.loads(line)
+            if change["column"] in df.columns and 0 <= change["id"] < len(df):
+                set_cell(df, change["id"], change["column"], change["value"])
+    return df
+
+# df.index holds a stable uid per row (never reused), so derived structures
+# can follow a row while its position (the "id" used by the API) shifts.
+next_row_uid = 0
+
+def assign_row_uids(frame):
+    global next_row_uid
+    frame.index = pd.RangeIndex(next_row_uid, next_row_uid + len(frame))
+    next_row_uid += len(frame)
+    return frame
+
+# Empty until warm_up() has read DATA_FILE and replayed the journal
+df = assign_row_uids(pd.DataFrame(columns=REQUIRED_COLUMNS))
+# False while df holds data that DATA_FILE + JOURNAL_FILE cannot reproduce
+# (e.g. right after an upload), in which case edits fall back to a full write.
+journal_in_sync = True
+
+# Held by every endpoint that mutates df or writes DATA_FILE, so concurrent
+# requests cannot lose each other's rows or interleave workbook writes
+data_lock = threading.RLock()
+
+@contextmanager
+def locked_data(excel=False):
+    # excel=True for mutations that rewrite DATA_FILE (xlsx backend): the
+    # Excel slot for that write is reserved before the caller changes df
+    with timed_phase("lock_wait"):
+        data_lock.acquire()
+    try:
+        if STORAGE_BACKEND == "sqlite":
+            # Other processes cannot commit until this mutation has
+            with store_transaction(open_store()):
+                refresh_from_store()
+                yield
+        elif excel:
+            with excel_slot():
+                yield
+        else:
+            yield
+    finally:
+        data_lock.release()
+
+# Incremented on every change to df; used to key derived data such as exports
+data_version = 0
+
+def dataset_changed(added=None, removed=None, edited=None, persist=True):
+    # Called after every mutation of df. added is a frame of the new rows,
+    # removed/edited are row uids; with none of them df was replaced wholesale.
+    # persist=False when df was just loaded from the store.
+    global data_version
+    data_version += 1
+    if persist and STORAGE_BACKEND == "sqlite":
+        with timed_phase("store_write"):
+            store_changed(added, removed, edited)
+    with timed_phase("index_update"):
+        if added is None and removed is None and edited is None:
+            rebuild_text_index()
+            rebuild_duplicate_index()
+            rebuild_band_index()
+            with data_indexes_lock:
+                rebuild_data_indexes()
+                data_indexes["frame"] = df
+            return
+        if removed is not None:
+            text_index_remove(removed)
+            duplicate_index_remove(removed)
+        if edited is not None:
+            text_index_remove(edited)
+            duplicate_index_remove(edited)
+            text_index_add(df.loc[edited])
+            duplicate_index_add(df.loc[edited])
+        if added is not None:
+            text_index_add(added)
+            duplicate_index_add(added)
+        update_band_index(edited)
+        with data_indexes_lock:
+            if removed is not None:
+                data_index_remove(removed)
+            if edited is not None:
+                data_index_remove(edited)
+                data_index_add(df.loc[edited])
+            if added is not None:
+                data_index_add(added)
+            data_indexes["frame"] = df
+
+EXPORT_DIR = "exports"
+export_cache = {}
+export_lock = threading.Lock()
+
+def write_data_file():
+    # Callers hold data_lock until this returns, so df cannot change while
+    # its column arrays are being sent to the worker. Until the new file is in
+    # place DATA_FILE + JOURNAL_FILE describe the old rows, so edits must not
+    # be journaled (their ids refer to df); a failed write leaves it that way.
+    global journal_in_sync
+    journal_in_sync = False
+    root, ext = os.path.splitext(DATA_FILE)
+    tmp_path = f"{root}.tmp{ext}"
+    result = run_excel_job(excel_worker.write_workbook, tmp_path, *excel_worker.to_columns(df), band_ids(df))
+    os.replace(tmp_path, DATA_FILE)
+    if os.path.exists(JOURNAL_FILE):
+        os.remove(JOURNAL_FILE)
+    journal_in_sync = True
+    trace_set(data_file_bytes=result["bytes"])
+
+def append_journal(changes):
+    with timed_phase("journal_append"), open(JOURNAL_FILE, "a", encoding="utf-8") as f:
+        for change in changes:
+            f.write(json.dumps(change, ensure_ascii=False, default=str) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    trace_set(journal_bytes=os.path.getsize(JOURNAL_FILE))
+
+# ==========================
+# SQLite store
+# ==========================
+# With STORAGE_BACKEND=sqlite the rows live in SQLITE_FILE and df is the
+# in-memory working copy. dataset_changed() commits every change as one small
+# transaction (upsert of added/edited rows, delete of removed ones) instead of
+# rewriting a workbook. Row order is kept in a fractional "pos" key, so rows
+# inserted in the middle of a patient's block do not renumber the others.
+# On first start an existing DATA_FILE (and its journal) is imported.
+#
+# Several processes (uvicorn --workers N) can share the store. A mutation
+# holds the database write lock from locked_data() until it commits, and
+# first brings df up to date if another process committed since (meta
+# "version" is bumped by every commit). Before an API request that reads df,
+# StoreRefreshMiddleware compares that version with the one df reflects, so a
+# worker only refreshes when the data actually changed. Each commit also logs
+# which rows it removed or wrote in the "changes" table, keyed by version, so
+# the other workers apply just those rows instead of reloading the table.
+STORE_INDEXED_COLUMNS = [
+    "NOMBRE DE BENEFICIARIO", "CEDULA", "FECHA ANTENCION", "FECHA DE INGRESO", "FECHA DE EGRESO",
+]
+# Dates are stored as text in this format
+STORE_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+STORE_DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}")
+# Python types sqlite3 binds as they are
+STORE_NATIVE_TYPES = (str, int, float, bool, type(None))
+# Seconds a mutation waits for another process's transaction to finish
+STORE_LOCK_TIMEOUT = float(os.environ.get("STORE_LOCK_TIMEOUT", "30"))
+# Commits kept in the change log; a worker further behind reloads the table
+STORE_CHANGE_LOG_SIZE = int(os.environ.get("STORE_CHANGE_LOG_SIZE", "1000"))
+store_connection = None
+# Separate connection for the per-request version check (event loop thread)
+store_poll_connection = None
+# Columns (name -> dtype) as recorded in the store, and the row uid -> pos key
+store_columns = {}
+store_keys = pd.Series(dtype=float)
+# Store version df reflects (None: reload before use), and whether the open
+# transaction has written anything
+store_version = None
+store_dirty = False
+
+def quote_column(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def connect_store():
+    # Autocommit mode: transactions are opened explicitly by store_transaction()
+    connection = sqlite3.connect(SQLITE_FILE, check_same_thread=False, isolation_level=None, timeout=STORE_LOCK_TIMEOUT)
+    # WAL lets the other workers read while one of them writes
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+def open_store():
+    global store_connection
+    if store_connection is None:
+        store_connection = connect_store()
+        with store_transaction(store_connection):
+            store_connection.execute("CREATE TABLE IF NOT EXISTS rows (uid INTEGER PRIMARY KEY, pos REAL NOT NULL)")
+            store_connection.execute("CREATE INDEX IF NOT EXISTS rows_pos ON rows (pos)")
+            store_connection.execute(
+                "CREATE TABLE IF NOT EXISTS columns (name TEXT PRIMARY KEY, ordinal INTEGER NOT NULL, dtype TEXT NOT NULL)"
+            )
+            store_connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            store_connection.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0), ('next_uid', 0)")
+            # change is NULL when the commit rewrote the whole table
+            store_connection.execute("CREATE TABLE IF NOT EXISTS changes (version INTEGER PRIMARY KEY, change TEXT)")
+    return store_connection
+
+def close_store():
+    global store_connection, store_poll_connection
+    for connection in (store_connection, store_poll_connection):
+        if connection is not None:
+            connection.close()
+    store_connection = store_poll_connection = None
+
+@contextmanager
+def store_transaction(connection, immediate=True):
+    # BEGIN IMMEDIATE takes the write lock up front (waiting up to
+    # STORE_LOCK_TIMEOUT for other processes); BEGIN is a read snapshot.
+    # Nested calls join the transaction already open.
+    global store_version, store_dirty
+    if connection.in_transaction:
+        yield
+        return
+    with timed_phase("store_lock_wait"):
+        try:
+            connection.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        except sqlite3.OperationalError as e:
+            raise HTTPException(status_code=503, detail=f"Data store is busy: {e}", headers={"Retry-After": "1"})
+    store_dirty = False
+    try:
+        yield
+    except BaseException:
+        connection.execute("ROLLBACK")
+        if store_dirty:
+            # df already holds the change that was just rolled back
+            store_version = None
+        raise
+    connection.execute("COMMIT")
+
+def read_store_version(connection):
+    return connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+def poll_store_version():
+    global store_poll_connection
+    if store_poll_connection is None:
+        open_store()
+        store_poll_connection = connect_store()
+    return read_store_version(store_poll_connection)
+
+def bump_store_version(connection, change=None):
+    # change: {"removed": uids, "upserted": uids, "reordered": bool}, or None
+    # when the whole table was rewritten
+    global store_version, store_dirty
+    connection.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+    connection.execute("UPDATE meta SET value = ? WHERE key = 'next_uid'", (next_row_uid,))
+    store_version = read_store_version(connection)
+    connection.execute(
+        "INSERT OR REPLACE INTO changes (version, change) VALUES (?, ?)",
+        (store_version, None if change is None else json.dumps(change)),
+    )
+    connection.execute("DELETE FROM changes WHERE version <= ?", (store_version - STORE_CHANGE_LOG_SIZE,))
+    store_dirty = True
+
+def sync_store_columns(connection, frame):
+    # Adds table columns df gained (e.g. "OBSERVACIONES" from /add/) and
+    # records the current column order and dtypes
+    global store_columns
+    current = {col: str(frame[col].dtype) for col in frame.columns}
+    if current == store_columns and list(current) == list(store_columns):
+        return
+    existing = {row[1] for row in connection.execute("PRAGMA table_info(rows)")}
+    for col in current:
+        if col not in existing:
+            connection.execute(f"ALTER TABLE rows ADD COLUMN {quote_column(col)}")
+            if col in STORE_INDEXED_COLUMNS:
+                connection.execute(f"CREATE INDEX rows_{STORE_INDEXED_COLUMNS.index(col)} ON rows ({quote_column(col)})")
+    connection.execute("DELETE FROM columns")
+    connection.executemany(
+        "INSERT INTO columns (name, ordinal, dtype) VALUES (?, ?, ?)",
+        [(col, i, dtype) for i, (col, dtype) in enumerate(current.items())],
+    )
+    store_columns = current
+
+def store_cell(value):
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return pd.Timestamp(value).strftime(STORE_DATE_FORMAT)
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+def store_values(frame, keys):
+    # Row tuples (uid, pos, values...) with None for missing values and
+    # dates as "YYYY-MM-DD HH:MM:SS" text
+    columns = [frame.index.tolist(), keys.tolist()]
+    for col in frame.columns:
+        series = frame[col]
+        if series.dtype.kind == "M":
+            values = series.dt.strftime(STORE_DATE_FORMAT)
+        else:
+            values = series.astype(object)
+        values = values.where(series.notna(), None).tolist()
+        if series.dtype == object:
+            values = [value if type(value) in STORE_NATIVE_TYPES else store_cell(value) for value in values]
+        columns.append(values)
+    return list(zip(*columns))
+
+def store_upsert(connection, frame, keys):
+    names = ", ".join(["uid", "pos"] + [quote_column(col) for col in frame.columns])
+    placeholders = ", ".join("?" * (len(frame.columns) + 2))
+    connection.executemany(f"INSERT OR REPLACE INTO rows ({names}) VALUES ({placeholders})", store_values(frame, keys))
+
+def row_keys_for(frame):
+    # pos keys for df's rows: existing rows keep theirs, new rows get evenly
+    # spaced keys between their neighbours. Returns (keys, renumbered).
+    values = store_keys.reindex(frame.index).to_numpy(dtype=float, copy=True)
+    new = np.isnan(values)
+    known = np.flatnonzero(~new)
+    if len(known) and new.any():
+        positions = np.flatnonzero(new)
+        values[new] = np.interp(positions, known, values[known])
+        before, after = positions < known[0], positions > known[-1]
+        values[positions[before]] = values[known[0]] - (known[0] - positions[before])
+        values[positions[after]] = values[known[-1]] + (positions[after] - known[-1])
+    if not len(known) or (len(values) > 1 and not (np.diff(values) > 0).all()):
+        # No room left between two keys (or nothing to anchor to): renumber
+        return pd.Series(np.arange(len(frame), dtype=float), index=frame.index), True
+    return pd.Series(values, index=frame.index), False
+
+def store_changed(added=None, removed=None, edited=None):
+    # Runs inside the transaction opened by locked_data()
+    global store_keys
+    connection = open_store()
+    with store_transaction(connection):
+        sync_store_columns(connection, df)
+        if added is None and removed is None and edited is None:
+            connection.execute("DELETE FROM rows")
+            store_keys = pd.Series(np.arange(len(df), dtype=float), index=df.index)
+            store_upsert(connection, df, store_keys)
+            bump_store_version(connection)
+            trace_set(store_rows_written=len(df))
+            return
+        removed = [] if removed is None else [int(uid) for uid in removed]
+        if removed:
+            connection.executemany("DELETE FROM rows WHERE uid = ?", [(uid,) for uid in removed])
+            store_keys = store_keys.drop(removed, errors="ignore")
+        changed = []
+        renumbered = False
+        if added is not None:
+            keys, renumbered = row_keys_for(df)
+            if renumbered:
+                connection.executemany(
+                    "UPDATE rows SET pos = ? WHERE uid = ?", list(zip(keys.tolist(), keys.index.tolist()))
+                )
+            store_keys = keys
+            changed.extend(added.index.tolist())
+        if edited is not None:
+            changed.extend(pd.Index(edited).tolist())
+        rows = df.loc[df.index.intersection(pd.Index(changed))]
+        if len(rows):
+            store_upsert(connection, rows, store_keys.loc[rows.index])
+        bump_store_version(connection, {"removed": removed, "upserted": rows.index.tolist(), "reordered": renumbered})
+        trace_set(store_rows_written=len(changed))
+
+def read_stored_columns(connection):
+    return {name: dtype for name, dtype in connection.execute("SELECT name, dtype FROM columns ORDER BY ordinal")}
+
+def read_store_rows(connection, where="", params=()):
+    # (rows, pos keys) for the stored rows matching where, in pos order and
+    # with the dtypes recorded in store_columns
+    names = ", ".join(["uid", "pos"] + [quote_column(col) for col in store_columns])
+    frame = pd.read_sql_query(f"SELECT {names} FROM rows {where} ORDER BY pos", connection, index_col="uid", params=params)
+    keys = frame.pop("pos").astype(float)
+    for col, dtype in store_columns.items():
+        if dtype.startswith("datetime64"):
+            frame[col] = pd.to_datetime(frame[col])
+        elif dtype.startswith("int") and frame[col].isna().any():
+            frame[col] = frame[col].astype(float)
+        else:
+            frame[col] = frame[col].astype(dtype)
+        if dtype == "object":
+            # Dates mixed with text (e.g. "" from /add/) were stored as text
+            stamps = np.array([isinstance(value, str) and STORE_DATE_PATTERN.fullmatch(value) is not None
+                               for value in frame[col].tolist()], dtype=bool)
+            if stamps.any():
+                frame.loc[stamps, col] = pd.to_datetime(frame.loc[stamps, col]).astype(object)
+    frame.index = frame.index.astype(np.int64).rename(None)
+    keys.index = frame.index
+    return frame, keys
+
+def read_next_uid(connection, frame):
+    stored_next_uid = connection.execute("SELECT value FROM meta WHERE key = 'next_uid'").fetchone()[0]
+    return max(next_row_uid, stored_next_uid, int(frame.index.max()) + 1 if len(frame) else 0)
+
+def read_store(connection):
+    # df as stored, or None while the store has never been written
+    global next_row_uid, store_keys, store_columns, store_version
+    store_columns = read_stored_columns(connection)
+    if not store_columns:
+        return None
+    frame, store_keys = read_store_rows(connection)
+    next_row_uid = read_next_uid(connection, frame)
+    store_version = read_store_version(connection)
+    return frame
+
+def load_store():
+    # df as stored in SQLITE_FILE; on first start, DATA_FILE is imported (by
+    # whichever worker gets there first). Called with data_lock held.
+    global store_keys
+    connection = open_store()
+    with store_transaction(connection, immediate=False):
+        frame = read_store(connection)
+    if frame is None:
+        with store_transaction(connection):
+            frame = read_store(connection)
+            if frame is None:
+                frame = assign_row_uids(load_data_file())
+                sync_store_columns(connection, frame)
+                store_keys = pd.Series(np.arange(len(frame), dtype=float), index=frame.index)
+                store_upsert(connection, frame, store_keys)
+                bump_store_version(connection)
+    return frame
+
+def store_dtype_widens(old, new):
+    # Whether a column of dtype old converts to new as a reload would read it
+    return new == "object" or (old.startswith("int") and new.startswith("float"))
+
+def apply_store_changes(connection):
+    # Applies the commits logged since store_version to df, reading only the
+    # rows they wrote. False when the table has to be reloaded instead: the
+    # log no longer reaches back that far, a commit rewrote the whole table,
+    # or the columns changed in a way df cannot follow. Text columns added at
+    # the end (e.g. "OBSERVACIONES" from /add/) are empty in the rows df
+    # already has, and widened dtypes (e.g. CEDULA after /add/) are converted.
+    global df, store_keys, store_version, next_row_uid, store_columns
+    if store_version is None:
+        return False
+    with store_transaction(connection, immediate=False):
+        version = read_store_version(connection)
+        logged = [change for change, in connection.execute(
+            "SELECT change FROM changes WHERE version > ? ORDER BY version", (store_version,)
+        )]
+        columns = read_stored_columns(connection)
+        new_columns = list(columns)[len(store_columns):]
+        widened = {col: columns.get(col) for col in store_columns if columns.get(col) != store_columns[col]}
+        if (len(logged) != version - store_version or None in logged
+                or list(columns)[:len(store_columns)] != list(store_columns) or list(store_columns) != list(df.columns)
+                or any(columns[col] != "object" for col in new_columns)
+                or not all(store_dtype_widens(store_columns[col], dtype) for col, dtype in widened.items())):
+            return False
+        store_columns = columns
+        removed, upserted, reordered = set(), set(), False
+        for change in map(json.loads, logged):
+            # An undone delete writes the removed uids back
+            upserted.difference_update(change["removed"])
+            removed.update(change["removed"])
+            removed.difference_update(change["upserted"])
+            upserted.update(change["upserted"])
+            reordered |= change["reordered"]
+        rows, keys = read_store_rows(connection, "WHERE uid IN (SELECT value FROM json_each(?))", (json.dumps(sorted(upserted)),))
+        if reordered:
+            keys = pd.read_sql_query("SELECT uid, pos FROM rows", connection, index_col="uid")["pos"].astype(float)
+            keys.index = keys.index.astype(np.int64)
+        next_uid = read_next_uid(connection, rows)
+    gone = df.index.intersection(pd.Index(sorted(removed), dtype=np.int64))
+    frame = df[~df.index.isin(gone.append(rows.index))]
+    if widened:
+        frame = frame.astype(widened)
+    if new_columns:
+        frame = frame.assign(**{col: None for col in new_columns})
+    if len(rows):
+        frame = pd.concat([frame, rows])
+    if not reordered:
+        keys = pd.concat([store_keys[store_keys.index.isin(frame.index) & ~store_keys.index.isin(rows.index)], keys])
+    order = keys.reindex(frame.index).to_numpy()
+    if np.isnan(order).any():
+        return False
+    if not (np.diff(order) > 0).all():
+        frame = frame.iloc[np.argsort(order, kind="stable")]
+    edited = rows.index[rows.index.isin(df.index)]
+    added = rows.index[~rows.index.isin(df.index)]
+    df = frame
+    store_keys = keys.reindex(frame.index)
+    store_version = version
+    next_row_uid = next_uid
+    dataset_changed(added=df.loc[added], removed=gone, edited=edited, persist=False)
+    trace_set(store_rows_read=len(rows))
+    return True
+
+def refresh_from_store():
+    # Brings df up to date if another process committed since df was loaded
+    # or last written here: the logged changes are applied when possible,
+    # otherwise the table is reloaded. The undo history refers to the old
+    # rows, so it is dropped.
+    global df
+    connection = open_store()
+    with data_lock:
+        if store_version is not None and read_store_version(connection) == store_version:
+            return False
+        with timed_phase("store_refresh"):
+            if not apply_store_changes(connection):
+                df = load_store()
+                dataset_changed(persist=False)
+        undo_stack.clear()
+        redo_stack.clear()
+    return True
 
 grid_columns = [
     'FECHA DE INGRESO',
@@ -140,18 +1166,6 @@ grid_columns = [
     'OBSERVACIONES'
 ]
 
-color_fills = [
-    PatternFill(start_color="FF92D050", end_color="FF92D050", fill_type="darkGrid"),
-    PatternFill(start_color="FF00B0F0", end_color="FF00B0F0", fill_type="darkTrellis"),
-    PatternFill(start_color="FFFFC000", end_color="FFFFC000", fill_type="lightGrid"),
-    PatternFill(start_color="FF7030A0", end_color="FF7030A0", fill_type="lightTrellis"),
-    PatternFill(start_color="FF00B050", end_color="FF00B050", fill_type="darkHorizontal"),
-    PatternFill(start_color="FFED7D31", end_color="FFED7D31", fill_type="darkVertical"),
-    PatternFill(start_color="FFFF0000", end_color="FFFF0000", fill_type="lightHorizontal"),
-    PatternFill(start_color="FF4472C4", end_color="FF4472C4", fill_type="lightVertical"),
-    PatternFill(start_color="FFBFBFBF", end_color="FFBFBFBF", fill_type="darkDown"),
-    PatternFill(start_color="FFFF00FF", end_color="FFFF00FF", fill_type="darkUp")
-]
 
 # -----------------------------
 # Pydantic Models
@@ -176,127 +1190,949 @@ class NewEntry(BaseModel):
 class DeleteRows(BaseModel):
     ids: list[int]
 
+class CellEdit(BaseModel):
+    id: int
+    column: str
+    value: str | int | float | None = None
+
+class EditCells(BaseModel):
+    changes: list[CellEdit]
+
+# -----------------------------
+# Merge uploads
+# -----------------------------
+# /upload/?mode=merge matches incoming rows to existing ones on a key instead
+# of replacing df. The n-th incoming row with a given key pairs with the n-th
+# existing row with that key, so repeated line items (same cedula, date and
+# code) are matched one to one rather than collapsed.
+MERGE_KEY_COLUMNS = ["CEDULA", "FECHA ANTENCION", "CODIGO"]
+
+def normalized_column(frame, col):
+    # normalize_key (or the day, for FECHA columns) of every cell as a string,
+    # "" for empty cells. Computed once per distinct value, then broadcast.
+    codes, uniques = pd.factorize(frame[col])
+    if "FECHA" in col:
+        days = parse_dates(pd.Series(uniques)).to_numpy().astype("datetime64[D]")
+        text = [normalize_key(value) or "" if np.isnat(day) else str(day) for value, day in zip(uniques, days)]
+    else:
+        text = [normalize_key(value) or "" for value in uniques]
+    return pd.Series(np.append(np.array(text, dtype=object), "")[codes], index=frame.index)
+
+def merge_key(frame, columns):
+    # One hashable string per row: normalized key values plus occurrence number
+    parts = [normalized_column(frame, col).reset_index(drop=True) for col in columns]
+    key = parts[0].str.cat(parts[1:], sep="\x1f") if len(parts) > 1 else parts[0]
+    occurrence = key.groupby(key, sort=False).cumcount()
+    return key + "\x1e" + occurrence.astype(str)
+
+def normalize_cell(value):
+    # Like normalize_key but case-sensitive: "" and NaN, 7 and 7.0, "0912" and
+    # 912 (Excel drops leading zeros) compare equal
+    if value is None or value == "" or (isinstance(value, float) and math.isnan(value)) or value is pd.NaT:
+        return None
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return pd.Timestamp(value)
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    value = str(value).strip()
+    return value.lstrip("0") or "0" if value.isdigit() else value
+
+def values_differ(old, new):
+    old = pd.Series(old, dtype=object)
+    new = pd.Series(new, dtype=object)
+    differ = ~((old.to_numpy() == new.to_numpy()) | (old.isna().to_numpy() & new.isna().to_numpy()))
+    # Only the cells that differ as stored get the (slower) normalized check
+    candidates = np.flatnonzero(differ)
+    if len(candidates):
+        differ[candidates] = [
+            normalize_cell(a) != normalize_cell(b) for a, b in zip(old.to_numpy()[candidates], new.to_numpy()[candidates])
+        ]
+    return differ
+
+def coerce_like(values, like):
+    # Date strings from a CSV are parsed when the existing column holds dates
+    if like.dtype.kind == "M" and values.dtype.kind != "M":
+        parsed = parse_dates(values)
+        if parsed.notna().sum() == values.replace("", None).notna().sum():
+            return parsed
+    return values
+
+def merge_rows(frame, incoming, key_columns, columns):
+    # Updates matched rows (only the given columns) and inserts the unmatched
+    # ones at their patient's block. frame itself is never modified: updates go
+    # to a copy, so a failure part way leaves the caller's df as it was.
+    # Returns the merged frame, the new rows, the uids of updated rows, the
+    # counts and the previous values of the changed cells as (uid, column, value).
+    incoming = incoming.copy()
+    for col in columns:
+        incoming[col] = coerce_like(incoming[col], frame[col])
+    with timed_phase("merge_join"):
+        positions = pd.Index(merge_key(frame, key_columns)).get_indexer(merge_key(incoming, key_columns))
+        matched = positions >= 0
+        target = positions[matched]
+        source = incoming[matched]
+    with timed_phase("merge_update"):
+        changed = np.zeros(len(target), dtype=bool)
+        old_cells = []
+        merged = frame
+        for col in columns:
+            old_values = frame[col].to_numpy()[target]
+            new_values = source[col].to_numpy()
+            differ = values_differ(old_values, new_values)
+            if not differ.any():
+                continue
+            if merged is frame:
+                # Copied on the first change only; a no-op merge copies nothing
+                merged = frame.copy()
+            changed |= differ
+            old_cells.extend((uid, col, value) for uid, value in zip(frame.index[target[differ]], old_values[differ]))
+            series = merged[col]
+            if series.dtype != new_values.dtype:
+                numeric = series.dtype.kind in "biuf" and new_values.dtype.kind in "biuf"
+                merged[col] = series.astype(np.result_type(series.dtype, new_values.dtype) if numeric else object)
+            merged.iloc[target[differ], merged.columns.get_loc(col)] = new_values[differ]
+        updated = frame.index[target[changed]]
+    # New rows only carry the file's columns; the rest stay empty (NaN) in
+    # the existing dtypes rather than "" from normalize_dataframe
+    new_entries = incoming.loc[~matched, list(dict.fromkeys(["NOMBRE DE BENEFICIARIO"] + columns))]
+    merged, new_frame = insert_rows(merged, new_entries, inherit=False)
+    counts = {"inserted": len(new_entries), "updated": int(changed.sum()), "unchanged": int((~changed).sum())}
+    return merged, new_frame, updated, counts, old_cells
+
 # -----------------------------
 # Endpoints
 # -----------------------------
+def merge_upload(temp_df, key_columns, present):
+    global df, journal_in_sync
+    with locked_data():
+        df, new_frame, updated, counts, old_cells = merge_rows(df, temp_df.reset_index(drop=True), key_columns, present)
+        journal_in_sync = False
+        dataset_changed(added=new_frame, edited=updated)
+        record_undo("upload_merge", [("remove", new_frame.index), ("cells", old_cells)])
+        return counts, duplicate_warnings(new_frame)
+
+def replace_upload(temp_df):
+    global df, journal_in_sync
+    with locked_data():
+        previous = df
+        df = assign_row_uids(temp_df)
+        journal_in_sync = False
+        dataset_changed()
+        # The old frame is kept as is (not copied); df is a new object
+        record_undo("upload", [("replace", previous)])
+    with duplicate_index_lock:
+        return sum(len(uids) > 1 for uids in duplicate_index["groups"].values())
+
 @app.post("/upload/")
-async def upload_file(file: UploadFile = File(...)):
-    global df
-    try:
-        contents = await file.read()
-        file_location = f"./{file.filename}"
-        with open(file_location, "wb") as f:
-            f.write(contents)
-        if file.filename.lower().endswith('.csv'):
-            temp_df = pd.read_csv(BytesIO(contents))
-        else:
-            temp_df = pd.read_excel(BytesIO(contents))
-        temp_df.columns = temp_df.columns.str.strip()
-        temp_df = normalize_dataframe(temp_df, REQUIRED_COLUMNS)
-        df = temp_df
-        return {"message": "File uploaded and loaded successfully."}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+async def upload_file(file: UploadFile = File(...), mode: str = "replace", key: str = None):
+    if mode not in ("replace", "merge"):
+        raise HTTPException(status_code=400, detail=f"Unknown mode: {mode}")
+    with traced_request("upload_file"):
+        try:
+            contents = await file.read()
+            trace_set(mode=mode, upload_bytes=len(contents), rows_before=len(df))
+            file_location = f"./{file.filename}"
+            with open(file_location, "wb") as f:
+                f.write(contents)
+            # Parsed in an Excel worker; the event loop only awaits the result
+            temp_df = await asyncio.to_thread(read_table, contents, file.filename)
+            with timed_phase("normalize"):
+                temp_df.columns = temp_df.columns.str.strip()
+                # Columns the file actually has; merge leaves the others alone
+                present = [col for col in REQUIRED_COLUMNS if col in temp_df.columns]
+                temp_df = normalize_dataframe(temp_df, REQUIRED_COLUMNS)
+            if mode == "merge":
+                stripped = {col.strip(): col for col in REQUIRED_COLUMNS}
+                key_columns = [stripped.get(name.strip(), name.strip()) for name in key.split(",")] if key else MERGE_KEY_COLUMNS
+                missing = [col for col in key_columns if col not in present]
+                if missing:
+                    raise HTTPException(status_code=400, detail=f"Key columns missing from the file: {', '.join(missing)}")
+                # The locked part (data_lock, and the store's write lock with
+                # the SQLite backend) runs in a worker thread, so waiting for
+                # it or merging does not block the event loop
+                counts, duplicates = await asyncio.to_thread(merge_upload, temp_df, key_columns, present)
+                trace_set(rows_after=len(df), **counts)
+                return {"message": "File merged successfully.", "key": key_columns, **counts, "duplicates": duplicates}
+            duplicate_groups = await asyncio.to_thread(replace_upload, temp_df)
+            trace_set(rows_after=len(df), duplicate_groups=duplicate_groups)
+            return {"message": "File uploaded and loaded successfully.", "duplicate_groups": duplicate_groups}
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+# -----------------------------
+# Row payloads
+# -----------------------------
+# Large row payloads skip to_dict() and FastAPI's jsonable_encoder: each column
+# is converted once (missing values to None and datetime64 columns to ISO
+# strings, vectorized) and the result is serialized straight to bytes with
+# orjson (pinned in requirements.txt). shape=columns returns {"columns", "rows"} with
+# one list per row instead of one dict per row, about a third of the size.
+try:
+    import orjson
+except ImportError:
+    # Only for frozen builds packaged without it: the standard library
+    # serializer gives the same output, several times slower
+    orjson = None
+
+ROW_SHAPES = ("records", "columns")
+
+def json_default(value):
+    # Values neither serializer handles (Timestamps in object columns, numpy scalars)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+def dumps_json(content):
+    if orjson is not None:
+        return orjson.dumps(content, default=json_default)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=json_default).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content):
+        return dumps_json(content)
+
+def column_values(series):
+    # The column as a list of JSON-ready values
+    values = series.to_numpy()
+    if values.dtype.kind == "M":
+        unit = "s" if (values.astype("datetime64[s]") == values)[~np.isnat(values)].all() else "us"
+        text = np.datetime_as_string(values, unit=unit).astype(object)
+        text[np.isnat(values)] = None
+        return text.tolist()
+    if values.dtype.kind in "iub":
+        return values.tolist()
+    values = values.astype(object)
+    values[pd.isna(values)] = None
+    return values.tolist()
+
+def rows_payload(frame, ids, shape="records", bands=None):
+    if shape not in ROW_SHAPES:
+        raise HTTPException(status_code=400, detail=f"Unknown shape: {shape} (use {' or '.join(ROW_SHAPES)})")
+    columns = list(frame.columns) + ["id"]
+    lists = [column_values(frame[col]) for col in frame.columns] + [[int(idx) for idx in ids]]
+    if bands is not None:
+        columns.append("band")
+        lists.append(bands.tolist())
+    if shape == "columns":
+        return {"columns": columns, "rows": list(zip(*lists))}
+    return [dict(zip(columns, row)) for row in zip(*lists)]
+
+def records_with_ids(frame, ids):
+    return rows_payload(frame, ids)
 
 @app.get("/data/")
-def get_data():
-    records = df.to_dict(orient="records")
-    for idx, record in enumerate(records):
-        record["id"] = idx
-        for key, value in record.items():
-            if isinstance(value, float) and math.isnan(value):
-                record[key] = None
-    return records
+def get_data(shape: str = "records"):
+    frame = df
+    return FastJSONResponse(rows_payload(frame, range(len(frame)), shape, band_ids(frame)))
+
+# -----------------------------
+# Secondary indexes for /data/query
+# -----------------------------
+EQUALITY_INDEX_COLUMNS = {
+    "paciente": "NOMBRE DE BENEFICIARIO",
+    "cedula": "CEDULA",
+    "codigo": "CODIGO",
+    "diagnostico": "DIAGNOSTICO PRINCIPAL CIE-10",
+}
+DATE_INDEX_COLUMNS = {
+    "fecha_atencion": "FECHA ANTENCION",
+    "fecha_ingreso": "FECHA DE INGRESO",
+    "fecha_egreso": "FECHA DE EGRESO",
+}
+
+# Per filter: normalized key -> set of row uids plus row uid -> key
+# ("equality"), or the uids with a valid date sorted by date ("dates"; the
+# arrays are replaced, never changed in place), and the frame they describe.
+# Kept up to date by dataset_changed().
+data_indexes = {"frame": df, "equality": {}, "dates": {}}
+data_indexes_lock = threading.RLock()
+
+def normalize_key(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    value = str(value).strip().upper()
+    if value.isdigit():
+        # Excel drops leading zeros from numeric cedulas/codes
+        value = value.lstrip("0") or "0"
+    return value or None
+
+def parse_dates(series):
+    return pd.to_datetime(series, errors="coerce", format="mixed", dayfirst=True)
+
+def data_index_add(frame):
+    with data_indexes_lock:
+        for name, col in EQUALITY_INDEX_COLUMNS.items():
+            if col not in frame.columns:
+                continue
+            index = data_indexes["equality"].setdefault(name, {"groups": {}, "keys": {}})
+            groups, keys = index["groups"], index["keys"]
+            for uid, key in zip(frame.index.tolist(), frame[col].map(normalize_key).tolist()):
+                if key is not None:
+                    groups.setdefault(key, set()).add(uid)
+                    keys[uid] = key
+        for name, col in DATE_INDEX_COLUMNS.items():
+            if col not in frame.columns:
+                continue
+            parsed = parse_dates(frame[col]).to_numpy()
+            valid = np.flatnonzero(~np.isnat(parsed))
+            order = valid[np.argsort(parsed[valid], kind="stable")]
+            index = data_indexes["dates"].get(name)
+            if index is None:
+                data_indexes["dates"][name] = {"uids": frame.index.to_numpy()[order], "sorted": parsed[order]}
+                continue
+            at = np.searchsorted(index["sorted"], parsed[order], side="right")
+            index.update(
+                uids=np.insert(index["uids"], at, frame.index.to_numpy()[order]),
+                sorted=np.insert(index["sorted"], at, parsed[order]),
+            )
+
+def data_index_remove(uids):
+    with data_indexes_lock:
+        for index in data_indexes["equality"].values():
+            groups, keys = index["groups"], index["keys"]
+            for uid in uids:
+                key = keys.pop(uid, None)
+                if key is None:
+                    continue
+                group = groups[key]
+                group.discard(uid)
+                if not group:
+                    del groups[key]
+        for index in data_indexes["dates"].values():
+            keep = ~np.isin(index["uids"], np.asarray(uids, dtype=np.int64))
+            index.update(uids=index["uids"][keep], sorted=index["sorted"][keep])
+
+def rebuild_data_indexes():
+    with data_indexes_lock:
+        data_indexes["equality"], data_indexes["dates"] = {}, {}
+        data_index_add(df)
+
+def get_data_indexes():
+    # (frame, indexes): the indexes and the frame whose rows they describe.
+    # Read them with data_indexes_lock held; only that frame may be queried.
+    return data_indexes["frame"], data_indexes
+
+def uid_positions(frame, uids):
+    positions = frame.index.get_indexer(uids)
+    return np.sort(positions[positions >= 0])
+
+def date_range_uids(date_index, start, end):
+    lo = 0 if start is None else np.searchsorted(date_index["sorted"], start.to_datetime64(), side="left")
+    hi = len(date_index["sorted"]) if end is None else np.searchsorted(date_index["sorted"], end.to_datetime64(), side="right")
+    return date_index["uids"][lo:hi]
+
+def parse_query_date(value, name):
+    if value is None:
+        return None
+    parsed = pd.to_datetime(value, errors="coerce", format="mixed", dayfirst=True)
+    if pd.isna(parsed):
+        raise HTTPException(status_code=400, detail=f"Invalid date for {name}: {value}")
+    return parsed
+
+@app.get("/data/query")
+def query_data(
+    paciente: str = None,
+    cedula: str = None,
+    codigo: str = None,
+    diagnostico: str = None,
+    fecha_atencion_desde: str = None,
+    fecha_atencion_hasta: str = None,
+    fecha_ingreso_desde: str = None,
+    fecha_ingreso_hasta: str = None,
+    fecha_egreso_desde: str = None,
+    fecha_egreso_hasta: str = None,
+    sort: str = None,
+    descending: bool = False,
+    offset: int = 0,
+    limit: int = 100,
+    shape: str = "records",
+):
+    date_filters = {
+        "fecha_atencion": (fecha_atencion_desde, fecha_atencion_hasta),
+        "fecha_ingreso": (fecha_ingreso_desde, fecha_ingreso_hasta),
+        "fecha_egreso": (fecha_egreso_desde, fecha_egreso_hasta),
+    }
+    date_ranges = {}
+    for name, (desde, hasta) in date_filters.items():
+        start = parse_query_date(desde, f"{name}_desde")
+        end = parse_query_date(hasta, f"{name}_hasta")
+        if start is not None or end is not None:
+            date_ranges[name] = (start, end)
+    date_name = next((name for name, col in DATE_INDEX_COLUMNS.items() if col == sort), None)
+    # Row uids per filter, read in one go with the frame they belong to
+    with data_indexes_lock:
+        frame, indexes = get_data_indexes()
+        candidates = []
+        for name, value in (("paciente", paciente), ("cedula", cedula), ("codigo", codigo), ("diagnostico", diagnostico)):
+            if value is not None:
+                groups = indexes["equality"].get(name, {"groups": {}})["groups"]
+                candidates.append(np.fromiter(groups.get(normalize_key(value), ()), dtype=np.int64))
+        for name, (start, end) in date_ranges.items():
+            if name not in indexes["dates"]:
+                candidates.append(np.empty(0, dtype=np.int64))
+            else:
+                candidates.append(date_range_uids(indexes["dates"][name], start, end))
+        sort_dates = indexes["dates"].get(date_name)
+    candidates = [uid_positions(frame, uids) for uids in candidates]
+    if candidates:
+        # Intersect starting from the most selective filter
+        candidates.sort(key=len)
+        positions = candidates[0]
+        for other in candidates[1:]:
+            if len(positions) == 0:
+                break
+            positions = np.intersect1d(positions, other, assume_unique=True)
+    else:
+        positions = np.arange(len(frame))
+    if sort:
+        if sort not in frame.columns:
+            raise HTTPException(status_code=400, detail=f"Unknown column: {sort}")
+        if sort_dates is not None:
+            dates = pd.Series(sort_dates["sorted"], index=sort_dates["uids"])
+            keys = dates.reindex(frame.index[positions]).reset_index(drop=True)
+        else:
+            keys = frame[sort].iloc[positions].reset_index(drop=True)
+            if keys.dtype == object:
+                keys = keys.map(lambda v: None if v is None or v != v else str(v))
+        order = keys.sort_values(ascending=not descending, kind="stable", na_position="last").index.to_numpy()
+        positions = positions[order]
+    page = positions[max(offset, 0):max(offset, 0) + max(limit, 0)]
+    payload = rows_payload(frame.iloc[page], page, shape, band_ids(frame)[page])
+    if shape == "columns":
+        return FastJSONResponse({"total": int(len(positions)), **payload})
+    return FastJSONResponse({"total": int(len(positions)), "rows": payload})
+
+# -----------------------------
+# Full-text index over OBSERVACIONES / DESCRIPCIÓN
+# -----------------------------
+TEXT_INDEX_COLUMNS = ("OBSERVACIONES", "DESCRIPCIÓN")
+
+# token -> {row uid: term frequency}, plus the tokens of each row so it can be
+# removed again. Kept up to date by dataset_changed().
+text_index = {"postings": {}, "docs": {}}
+text_index_lock = threading.RLock()
+
+def tokenize(text):
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return re.findall(r"\w+", text)
+
+def text_index_add(frame):
+    cols = [col for col in frame.columns if col.strip() in TEXT_INDEX_COLUMNS]
+    if not cols:
+        return
+    with text_index_lock:
+        postings, docs = text_index["postings"], text_index["docs"]
+        for uid, *values in zip(frame.index, *(frame[col] for col in cols)):
+            counts = Counter()
+            for value in values:
+                if isinstance(value, str):
+                    counts.update(tokenize(value))
+            if counts:
+                docs[uid] = counts
+                for token, tf in counts.items():
+                    postings.setdefault(token, {})[uid] = tf
+
+def text_index_remove(uids):
+    with text_index_lock:
+        postings, docs = text_index["postings"], text_index["docs"]
+        for uid in uids:
+            for token in docs.pop(uid, ()):
+                rows = postings[token]
+                rows.pop(uid, None)
+                if not rows:
+                    del postings[token]
+
+def rebuild_text_index():
+    with text_index_lock:
+        text_index["postings"], text_index["docs"] = {}, {}
+        text_index_add(df)
+
+# -----------------------------
+# Duplicate charges
+# -----------------------------
+# Rows billing the same patient, date, code and quantity twice (typically two
+# coders working the same chart). Each row's key is hashed to a uint64; the
+# rows sharing a hash are kept per hash and updated by dataset_changed(), so
+# checking new rows costs O(new rows). Rows without a code are keyed on their
+# description instead; rows without a patient are ignored.
+DUPLICATE_KEY_COLUMNS = ["NOMBRE DE BENEFICIARIO", "FECHA ANTENCION", "CODIGO", "CANTIDAD"]
+
+# key hash -> set of row uids, and row uid -> key hash
+duplicate_index = {"groups": {}, "keys": {}}
+duplicate_index_lock = threading.RLock()
+
+def duplicate_hashes(frame):
+    if not len(frame):
+        return frame.index, np.array([], dtype=np.uint64)
+    # New rows may lack some columns (e.g. no FECHA ANTENCION to inherit)
+    frame = frame.reindex(columns=DUPLICATE_KEY_COLUMNS + ["DESCRIPCIÓN"])
+    patient, date, code, quantity, description = (normalized_column(frame, col) for col in frame.columns)
+    code = code.where(code != "", "#" + description)
+    keep = (patient != "").to_numpy()
+    key = patient.str.cat([date, code, quantity], sep="\x1f")[keep]
+    return frame.index[keep], pd.util.hash_array(key.to_numpy(dtype=object))
+
+def duplicate_index_add(frame):
+    uids, hashes = duplicate_hashes(frame)
+    with duplicate_index_lock:
+        groups, keys = duplicate_index["groups"], duplicate_index["keys"]
+        for uid, key in zip(uids.tolist(), hashes.tolist()):
+            groups.setdefault(key, set()).add(uid)
+            keys[uid] = key
+
+def duplicate_index_remove(uids):
+    with duplicate_index_lock:
+        groups, keys = duplicate_index["groups"], duplicate_index["keys"]
+        for uid in uids:
+            key = keys.pop(uid, None)
+            if key is None:
+                continue
+            group = groups[key]
+            group.discard(uid)
+            if not group:
+                del groups[key]
+
+def rebuild_duplicate_index():
+    with duplicate_index_lock:
+        duplicate_index["groups"], duplicate_index["keys"] = {}, {}
+        duplicate_index_add(df)
+
+def duplicates_of(uids):
+    # For each given row that now has a twin: its uid and the other uids
+    found = []
+    with duplicate_index_lock:
+        groups, keys = duplicate_index["groups"], duplicate_index["keys"]
+        for uid in uids:
+            key = keys.get(uid)
+            if key is not None and len(groups[key]) > 1:
+                found.append((uid, sorted(groups[key] - {uid})))
+    return found
+
+def duplicate_warnings(new_frame):
+    # Warnings for the add responses, with row ids (positions) as in /data/
+    found = duplicates_of(new_frame.index.tolist())
+    if not found:
+        return []
+    uids = [uid for uid, others in found for uid in [uid] + others]
+    position = dict(zip(uids, df.index.get_indexer(uids).tolist()))
+    return [
+        {"id": position[uid], "duplicate_of": sorted(position[other] for other in others)}
+        for uid, others in found
+    ]
+
+# -----------------------------
+# Color bands
+# -----------------------------
+# Consecutive rows with the same FECHA ANTENCION and patient form a band; the
+# band id counts bands from the top of df and picks the row's fill in every
+# workbook written (band % len(COLOR_BANDS)) and is returned by /data/. Per
+# row uid the index keeps whether the row starts a band and which uid was
+# above it then, so after a change only rows that are new, edited or have a
+# different row above them are compared again; the ids are a cumsum of the
+# start flags.
+BAND_KEY_COLUMNS = ["FECHA ANTENCION", "NOMBRE DE BENEFICIARIO"]
+
+band_index = {"starts": pd.Series(dtype=bool), "above": pd.Series(dtype="int64")}
+
+def empty_band_keys(values):
+    # None, NaN, NaT and "" are all an empty key: rows added for a new
+    # patient leave the first FECHA ANTENCION NaN and the following ones ""
+    empty = pd.isna(values)
+    if values.dtype == object:
+        empty |= values == ""
+    return empty
+
+def band_starts(frame, positions):
+    # Whether each row at positions differs in the band key from the row above
+    starts = np.ones(len(positions), dtype=bool)
+    inner = positions > 0
+    below = positions[inner]
+    same = np.ones(len(below), dtype=bool)
+    for col in BAND_KEY_COLUMNS:
+        if col not in frame.columns:
+            continue
+        values = frame[col].to_numpy()
+        here, above = values[below], values[below - 1]
+        here_empty, above_empty = empty_band_keys(here), empty_band_keys(above)
+        same &= np.where(here_empty | above_empty, here_empty & above_empty, here == above)
+    starts[inner] = ~same
+    return starts
+
+def update_band_index(edited=None):
+    frame = df
+    uids = frame.index
+    above = np.full(len(uids), -1, dtype=np.int64)
+    above[1:] = uids[:-1]
+    # New rows get an impossible uid above them, so they count as moved
+    starts = band_index["starts"].reindex(uids, fill_value=True).to_numpy(dtype=bool)
+    dirty = band_index["above"].reindex(uids, fill_value=-2).to_numpy() != above
+    if edited is not None:
+        positions = uids.get_indexer(edited)
+        positions = positions[positions >= 0]
+        dirty[positions] = True
+        # The row below an edited one is compared with its new values
+        dirty[positions[positions + 1 < len(uids)] + 1] = True
+    positions = np.flatnonzero(dirty)
+    starts[positions] = band_starts(frame, positions)
+    band_index.update(starts=pd.Series(starts, index=uids), above=pd.Series(above, index=uids))
+
+def rebuild_band_index():
+    band_index.update(starts=pd.Series(dtype=bool), above=pd.Series(dtype="int64"))
+    update_band_index()
+
+def band_ids(frame):
+    # Band id per row of frame (df, or a copy of it)
+    starts = band_index["starts"]
+    if starts.index.equals(frame.index):
+        starts = starts.to_numpy()
+    else:
+        # df was replaced after the index was last updated
+        starts = band_starts(frame, np.arange(len(frame)))
+    return np.cumsum(starts) - 1
+
+@app.get("/duplicates/")
+def get_duplicates():
+    # Every group of rows sharing a duplicate key, as row ids (positions)
+    with duplicate_index_lock:
+        groups = [sorted(uids) for uids in duplicate_index["groups"].values() if len(uids) > 1]
+    frame = df
+    positions = frame.index.get_indexer([uid for group in groups for uid in group]).tolist()
+    id_groups, start = [], 0
+    for group in groups:
+        ids = sorted(pos for pos in positions[start:start + len(group)] if pos >= 0)
+        start += len(group)
+        if len(ids) > 1:
+            id_groups.append(ids)
+    id_groups.sort()
+    firsts = [ids[0] for ids in id_groups]
+    columns = [col for col in DUPLICATE_KEY_COLUMNS if col in frame.columns]
+    result = records_with_ids(frame.iloc[firsts][columns], firsts)
+    for record, ids in zip(result, id_groups):
+        del record["id"]
+        record["ids"] = ids
+    return {"groups": len(result), "rows": sum(len(ids) for ids in id_groups), "duplicates": result}
+
+@app.get("/search/data/")
+def search_data(query: str, limit: int = 50):
+    tokens = set(tokenize(query))
+    if not tokens:
+        return []
+    with text_index_lock:
+        matches = [text_index["postings"].get(token) for token in tokens]
+        if any(rows is None for rows in matches):
+            return []
+        # Every term must match; score is the summed term frequency
+        matches.sort(key=len)
+        scores = dict(matches[0])
+        for rows in matches[1:]:
+            scores = {uid: score + rows[uid] for uid, score in scores.items() if uid in rows}
+        top = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+    positions = df.index.get_indexer([uid for uid, _ in top])
+    return [{"id": int(pos), "score": score} for pos, (_, score) in zip(positions, top) if pos >= 0]
+
+# -----------------------------
+# Catalog search cache
+# -----------------------------
+# Search-as-you-type sends "d", "di", "dia", ... so the full list of matching
+# row positions is cached per (search, catalog version, query), LRU-evicted by
+# entry count and bytes. A miss is answered by filtering the matches of the
+# longest cached prefix of the query instead of scanning the whole catalog,
+# since every row containing "diab" also contains "dia".
+QUERY_CACHE_MAX_ENTRIES = int(os.environ.get("QUERY_CACHE_MAX_ENTRIES", "4096"))
+QUERY_CACHE_MAX_BYTES = int(os.environ.get("QUERY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+query_cache = OrderedDict()
+query_cache_lock = threading.Lock()
+query_cache_stats = {"hit": 0, "narrowed": 0, "miss": 0, "evictions": 0, "bytes": 0}
+
+def query_cache_get(key):
+    with query_cache_lock:
+        positions = query_cache.get(key)
+        if positions is not None:
+            query_cache.move_to_end(key)
+        return positions
+
+def query_cache_put(key, positions):
+    with query_cache_lock:
+        if key in query_cache:
+            return
+        query_cache[key] = positions
+        query_cache_stats["bytes"] += positions.nbytes
+        while query_cache and (
+            len(query_cache) > QUERY_CACHE_MAX_ENTRIES or query_cache_stats["bytes"] > QUERY_CACHE_MAX_BYTES
+        ):
+            _, evicted = query_cache.popitem(last=False)
+            query_cache_stats["bytes"] -= evicted.nbytes
+            query_cache_stats["evictions"] += 1
+
+def catalog_matches(catalog, search, query):
+    # Positions of every row of the catalog snapshot whose column contains
+    # query (literal, case-insensitive), in catalog order
+    name, column = SEARCH_FIELDS[search]
+    query = query.lower()
+    key = (search, catalog["version"], query)
+    positions = query_cache_get(key)
+    if positions is not None:
+        with query_cache_lock:
+            query_cache_stats["hit"] += 1
+        return positions
+    candidates = None
+    for end in range(len(query) - 1, 0, -1):
+        candidates = query_cache_get((search, catalog["version"], query[:end]))
+        if candidates is not None:
+            break
+    if candidates is None:
+        with query_cache_lock:
+            query_cache_stats["miss"] += 1
+        found = catalog[name].find(column, query)
+    else:
+        with query_cache_lock:
+            query_cache_stats["narrowed"] += 1
+        found = catalog[name].find(column, query, candidates)
+    positions = found.astype(np.int32)
+    query_cache_put(key, positions)
+    return positions
 
 @app.get("/sync/diagnostic/")
 def sync_diagnostic(name: str = None, code: str = None):
+    diagnosticos = catalogs["diagnosticos"]
     if name:
-        row = diag_df[diag_df["NOMBRE"].str.lower() == name.lower()]
+        row = diagnosticos.find_exact("NOMBRE", name.lower(), search=True)
     elif code:
-        row = diag_df[diag_df["CÓDIGO"].astype(str) == str(code)]
+        row = diagnosticos.find_exact("CÓDIGO", str(code))
     else:
         raise HTTPException(status_code=400, detail="Provide either name or code")
-    if row.empty:
+    if row == -1:
         raise HTTPException(status_code=404, detail="Diagnostic not found")
-    return {"name": row.iloc[0]["NOMBRE"], "code": row.iloc[0]["CÓDIGO"]}
+    return {"name": diagnosticos.value("NOMBRE", row), "code": diagnosticos.value("CÓDIGO", row)}
+
+# Columns returned by each search
+SEARCH_RESULT_COLUMNS = {
+    "diagnostics": ["NOMBRE", "CÓDIGO"],
+    "diagnostics_code": ["NOMBRE", "CÓDIGO"],
+    "procedures": ["DESCRIPCIÓN", "CÓDIGO"],
+    "medications": ["concat", "CÓDIGO"],
+}
+SEARCH_MAX_LIMIT = 200
+
+def search_catalog(catalog, search, query, limit=50):
+    name, _ = SEARCH_FIELDS[search]
+    rows = catalog_matches(catalog, search, query)[:limit].tolist()
+    out = catalog[name].records(rows, SEARCH_RESULT_COLUMNS[search])
+    if search == "medications":
+        # Force CODIGO to be a string
+        for item in out:
+            item["CÓDIGO"] = str(item["CÓDIGO"])
+    return out
+
+@app.get("/search/")
+async def search_all(
+    query: str,
+    catalog_names: str = Query(default="diagnostics,procedures,medications", alias="catalogs"),
+    limit: int = 50,
+):
+    # One request for several catalogs (comma-separated SEARCH_FIELDS names),
+    # each searched in its own worker thread against the same snapshot
+    names = list(dict.fromkeys(name.strip() for name in catalog_names.split(",") if name.strip()))
+    unknown = [name for name in names if name not in SEARCH_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown catalogs: {', '.join(unknown)}")
+    limit = max(0, min(limit, SEARCH_MAX_LIMIT))
+    catalog = catalogs
+    results = await asyncio.gather(*(
+        asyncio.to_thread(search_catalog, catalog, name, query, limit) for name in names
+    ))
+    return {
+        "query": query,
+        "catalog_version": catalog["version"],
+        "results": dict(zip(names, results)),
+    }
+
+# Autocomplete over one WebSocket: the client sends
+# {"field": <search name>, "query": "...", "seq": n[, "limit": 50]} and gets
+# {"field", "seq", "query", "results"} back. Only the newest seq per field is
+# answered: an older message arriving late is dropped, and a query still
+# pending when a newer one for the same field arrives is cancelled (if it is
+# already running in its thread, its result is discarded).
+ws_search_stats = {"answered": 0, "superseded": 0, "dropped": 0, "errors": 0}
+
+def count_ws_search(outcome):
+    with metrics_lock:
+        ws_search_stats[outcome] += 1
+
+@app.websocket("/ws/search")
+async def search_socket(websocket: WebSocket):
+    await websocket.accept()
+    if not app_ready():
+        # 1013 = try again later
+        await websocket.close(code=1013, reason="Service is starting up")
+        return
+    latest = {}
+    tasks = {}
+    send_lock = asyncio.Lock()
+
+    async def send(message):
+        async with send_lock:
+            await websocket.send_json(message)
+
+    async def answer(field, query, seq, limit):
+        try:
+            results = await asyncio.to_thread(search_catalog, catalogs, field, query, limit)
+            if latest.get(field) != seq:
+                count_ws_search("superseded")
+                return
+            await send({"field": field, "seq": seq, "query": query, "results": results})
+            count_ws_search("answered")
+        except WebSocketDisconnect:
+            pass
+        except Exception as e:
+            count_ws_search("errors")
+            await send({"field": field, "seq": seq, "error": str(e)})
+
+    try:
+        while True:
+            text = await websocket.receive_text()
+            message = None
+            try:
+                message = json.loads(text)
+                field, query, seq = message["field"], str(message["query"]), int(message["seq"])
+                limit = max(0, min(int(message.get("limit", 50)), SEARCH_MAX_LIMIT))
+                if field not in SEARCH_FIELDS:
+                    raise ValueError(f"Unknown field: {field}")
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                count_ws_search("errors")
+                await send({"seq": message.get("seq") if isinstance(message, dict) else None, "error": str(e)})
+                continue
+            if field in latest and seq <= latest[field]:
+                count_ws_search("dropped")
+                continue
+            latest[field] = seq
+            previous = tasks.get(field)
+            if previous is not None and not previous.done():
+                previous.cancel()
+                count_ws_search("superseded")
+            tasks[field] = asyncio.create_task(answer(field, query, seq, limit))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for task in tasks.values():
+            task.cancel()
 
 @app.get("/search/diagnostics/")
 def search_diagnostics(query: str):
-    results = diag_df[diag_df["NOMBRE"].str.contains(query, case=False, na=False)].head(50)
-    return results[["NOMBRE", "CÓDIGO"]].to_dict(orient="records")
+    return search_catalog(catalogs, "diagnostics", query)
 
 @app.get("/search/diagnostics/code/")
 def search_diagnostics_code(query: str):
-    mask = diag_df["CÓDIGO"].astype(str).str.contains(query, case=False, na=False)
-    results = diag_df[mask].head(50)
-    return results[["NOMBRE", "CÓDIGO"]].to_dict(orient="records")
+    return search_catalog(catalogs, "diagnostics_code", query)
 
 @app.get("/search/procedures/")
 def search_procedures(query: str):
-    results = proc_df[proc_df["DESCRIPCIÓN"].str.contains(query, case=False, na=False)].head(50)
-    return results[["DESCRIPCIÓN", "CÓDIGO"]].to_dict(orient="records")
+    return search_catalog(catalogs, "procedures", query)
 
 @app.get("/search/medications/")
 def search_medications(query: str):
-    results = med_df[med_df["concat"].str.contains(query, case=False, na=False)].head(50)
-    # Force CODIGO to be a string
-    out = results[["concat", "CÓDIGO"]].to_dict(orient="records")
-    for item in out:
-        item["CÓDIGO"] = str(item["CÓDIGO"])
-    return out
+    return search_catalog(catalogs, "medications", query)
 
 @lru_cache(maxsize=1)
 @app.get("/patients/full/")
 def get_patients_full():
     return sorted(df["NOMBRE DE BENEFICIARIO"].dropna().unique().tolist())
 
-@lru_cache(maxsize=1)
 @app.get("/medications/full/")
 def get_medications_full():
-    out = []
-    for _, row in med_df.iterrows():
-        code_val = row["CÓDIGO"] if pd.notnull(row["CÓDIGO"]) else row["concat"].split(" - ")[0]
-        out.append({
-            "concat": row["concat"],
-            "CODIGO": str(code_val)
-        })
-    return out
+    return Response(content=catalogs["medicamentos"].full_json(), media_type="application/json")
 
-@lru_cache(maxsize=1)
 @app.get("/procedures/full/")
 def get_procedures_full():
-    out = []
-    for _, row in proc_df.iterrows():
-        out.append({
-            "DESCRIPCIÓN": row["DESCRIPCIÓN"],
-            "CÓDIGO": str(row["CÓDIGO"])
-        })
-    return out
+    return Response(content=catalogs["procedimientos"].full_json(), media_type="application/json")
 
-@lru_cache(maxsize=1)
 @app.get("/diagnostics/full/")
 def get_diagnostics_full():
-    out = []
-    for _, row in diag_df.iterrows():
-        out.append({
-            "NOMBRE": row["NOMBRE"],
-            "CÓDIGO": str(row["CÓDIGO"])
-        })
-    return out
+    return Response(content=catalogs["diagnosticos"].full_json(), media_type="application/json")
+
+EXPORT_MEDIA_TYPES = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "json": "application/json",
+}
+
+def write_export(frame, path, fmt):
+    if fmt == "xlsx":
+        run_excel_job(excel_worker.write_workbook, path, *excel_worker.to_columns(frame), band_ids(frame))
+    elif fmt == "csv":
+        frame.to_csv(path, index=False, encoding="utf-8")
+    elif fmt == "parquet":
+        # Mixed-type object columns (codes stored as numbers and text) cannot
+        # be written by pyarrow as-is
+        frame.astype({col: "string" for col in frame.columns if frame[col].dtype == object}).to_parquet(path, index=False)
+    else:
+        frame.to_json(path, orient="records", force_ascii=False, date_format="iso")
+
+def get_export(fmt, compress):
+    # Exports are built once per dataset version and served from disk. A
+    # version's files outlive it by one generation, since a FileResponse for
+    # them may still be streaming; older ones are removed when a newer version
+    # is generated (or on a later generation, if the file is still open).
+    with export_lock:
+        # The version and the copy are taken together, so a change landing in
+        # between cannot end up in a file named after the previous version.
+        # The file itself is written outside data_lock.
+        with data_lock:
+            version = data_version
+            key = (version, fmt, compress)
+            if key in export_cache and os.path.exists(export_cache[key]):
+                return export_cache[key]
+            written = os.path.exists(export_cache.get((version, fmt, False), ""))
+            frame = None if written else df.copy()
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        # Named per process: each uvicorn worker keeps its own versions
+        path = os.path.join(EXPORT_DIR, f"data-{os.getpid()}-v{version}.{fmt}")
+        if frame is not None:
+            tmp_path = os.path.join(EXPORT_DIR, f"data-{os.getpid()}-v{version}.tmp.{fmt}")
+            write_export(frame, tmp_path, fmt)
+            os.replace(tmp_path, path)
+            export_cache[(version, fmt, False)] = path
+        if compress:
+            with open(path, "rb") as src, gzip.open(path + ".gz.tmp", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(path + ".gz.tmp", path + ".gz")
+            export_cache[key] = path + ".gz"
+        kept = sorted({old_key[0] for old_key in export_cache}, reverse=True)[:2]
+        for old_key, old_path in list(export_cache.items()):
+            if old_key[0] not in kept:
+                try:
+                    if os.path.exists(old_path):
+                        os.remove(old_path)
+                except OSError:
+                    continue
+                del export_cache[old_key]
+        return export_cache[key]
 
 @app.get("/download/")
-def download_file():
-    if not os.path.exists(DATA_FILE):
-        raise HTTPException(status_code=404, detail="Data file not found")
-    return FileResponse(
-        path=DATA_FILE,
-        filename="data.xlsx",
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+def download_file(format: str = "xlsx", compress: bool = False):
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+    try:
+        path = get_export(format, compress)
+    except ImportError as e:
+        raise HTTPException(status_code=501, detail=f"Format {format} is not available: {e}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error generating export: {e}")
+    # FileResponse streams the file in fixed-size chunks
+    if compress:
+        return FileResponse(path=path, filename=f"data.{format}.gz", media_type="application/gzip")
+    return FileResponse(path=path, filename=f"data.{format}", media_type=EXPORT_MEDIA_TYPES[format])
 
-@app.post("/add/")
-def add_entry(entry: NewEntry):
-    global df
+def build_entry_rows(entry):
     base_row = {
         "NOMBRE DE BENEFICIARIO": entry.paciente,
         "DIAGNOSTICO PRINCIPAL CIE-10": entry.diagnostico_code,
@@ -307,84 +2143,778 @@ def add_entry(entry: NewEntry):
         "OBSERVACIONES": ""
     }
     new_entries = []
-    for item in entry.procedimientos:
+    for item in entry.procedimientos + entry.medicamentos + entry.insumos:
         if item.name:
             row = base_row.copy()
             row["DESCRIPCIÓN"] = item.name
             row["CODIGO"] = item.code
             row["CANTIDAD"] = item.quantity
             new_entries.append(row)
-    for item in entry.medicamentos:
-        if item.name:
-            row = base_row.copy()
-            row["DESCRIPCIÓN"] = item.name
-            row["CODIGO"] = item.code
-            row["CANTIDAD"] = item.quantity
-            new_entries.append(row)
-    for item in entry.insumos:
-        if item.name:
-            row = base_row.copy()
-            row["DESCRIPCIÓN"] = item.name
-            row["CODIGO"] = item.code
-            row["CANTIDAD"] = item.quantity
-            new_entries.append(row)
-    current_rows = df.to_dict(orient="records")
-    for new_row in new_entries:
-        patient = new_row["NOMBRE DE BENEFICIARIO"]
-        insertion_index = None
-        for i in range(len(current_rows) - 1, -1, -1):
-            if current_rows[i]["NOMBRE DE BENEFICIARIO"] == patient:
-                new_row["CÓDIGO DEPENDENCIA\n(ESPECIALIDAD)\n"] = current_rows[i].get("CÓDIGO DEPENDENCIA\n(ESPECIALIDAD)\n", "")
-                new_row["FECHA ANTENCION"] = current_rows[i].get("FECHA ANTENCION", "")
-                new_row["CEDULA"] = current_rows[i].get("CEDULA", "")
-                insertion_index = i + 1
-                break
-        if insertion_index is None:
-            current_rows.append(new_row)
+    return new_entries
+
+INHERITED_COLUMNS = [
+    "CÓDIGO DEPENDENCIA\n(ESPECIALIDAD)\n",
+    "FECHA ANTENCION",
+    "CEDULA",
+]
+
+def insert_rows(frame, new_entries, inherit=True):
+    # Each new row goes right after the last row of its patient (inheriting
+    # dependencia, fecha de atencion and cedula from it unless inherit is
+    # False); rows for unknown patients are appended at the end, grouped by
+    # patient. new_entries is a list of row dicts, or a DataFrame when inherit
+    # is False. Returns the merged frame and the new rows (with their row uids).
+    n = len(frame)
+    with timed_phase("insertion_scan"):
+        last_index = {}
+        if "NOMBRE DE BENEFICIARIO" in frame.columns:
+            for i, patient in enumerate(frame["NOMBRE DE BENEFICIARIO"].tolist()):
+                last_index[patient] = i
+        anchored_at, anchored_rows = [], []
+        new_patients = {}
+        if isinstance(new_entries, pd.DataFrame):
+            patients = new_entries["NOMBRE DE BENEFICIARIO"].tolist()
         else:
-            current_rows.insert(insertion_index, new_row)
-    df = pd.DataFrame(current_rows)
-    df.to_excel(DATA_FILE, index=False, columns=df.columns.tolist())
+            patients = [new_row["NOMBRE DE BENEFICIARIO"] for new_row in new_entries]
+        for j, patient in enumerate(patients):
+            if patient in last_index:
+                i = last_index[patient]
+                if inherit:
+                    for col in INHERITED_COLUMNS:
+                        new_entries[j][col] = frame.iat[i, frame.columns.get_loc(col)] if col in frame.columns else ""
+                anchored_at.append(i + 1)
+                anchored_rows.append(n + j)
+            else:
+                group = new_patients.setdefault(patient, [])
+                if group and inherit:
+                    for col in INHERITED_COLUMNS:
+                        new_entries[j][col] = new_entries[group[0]].get(col, "")
+                group.append(j)
+    with timed_phase("dataframe_rebuild"):
+        new_frame = assign_row_uids(pd.DataFrame(new_entries))
+        if not len(new_entries):
+            return frame, new_frame
+        columns = list(dict.fromkeys(frame.columns.tolist() + new_frame.columns.tolist()))
+        if n == 0:
+            return new_frame.reindex(columns=columns), new_frame
+        order = np.insert(np.arange(n), anchored_at, anchored_rows)
+        order = np.concatenate([order, [n + j for group in new_patients.values() for j in group]]).astype(np.intp)
+        block = new_frame.reindex(columns=columns)
+        # Columns the new rows do not set take the existing dtype (concat would
+        # otherwise warn about all-NA datetime columns)
+        block = block.astype({
+            col: frame[col].dtype for col in frame.columns
+            if frame[col].dtype.kind in "fOMm" and block[col].isna().all()
+        })
+        merged = pd.concat([frame, block]).iloc[order]
+    return merged, new_frame
+
+def persist_data():
+    # Called by the mutating endpoints after dataset_changed(). The SQLite
+    # store has already committed the change there; with the xlsx backend
+    # DATA_FILE is rewritten.
+    if STORAGE_BACKEND == "sqlite":
+        return
     try:
-        wb = load_workbook(DATA_FILE)
-        ws = wb.active
-        header = [cell.value for cell in ws[1]]
-        patient_idx = header.index("NOMBRE DE BENEFICIARIO") + 1
-        date_idx = header.index("FECHA ANTENCION") + 1
-        current_color_index = -1
-        prev_key = None
-        for r in range(2, ws.max_row + 1):
-            patient_val = ws.cell(row=r, column=patient_idx).value
-            date_val = ws.cell(row=r, column=date_idx).value
-            key = (date_val, patient_val)
-            if key != prev_key:
-                current_color_index = (current_color_index + 1) % len(color_fills)
-                prev_key = key
-            fill_to_use = color_fills[current_color_index]
-            for c in range(1, ws.max_column + 1):
-                ws.cell(row=r, column=c).fill = fill_to_use
-        wb.save(DATA_FILE)
+        write_data_file()
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error saving colored file: {e}")
-    return {"message": "Entry added successfully!"}
+        raise HTTPException(status_code=500, detail=f"Error saving data file: {e}")
+
+@app.post("/add/")
+def add_entry(entry: NewEntry):
+    global df
+    with traced_request("add_entry"), locked_data(excel=True):
+        with timed_phase("build_rows"):
+            new_entries = build_entry_rows(entry)
+        trace_set(rows_before=len(df), rows_added=len(new_entries))
+        df, new_frame = insert_rows(df, new_entries)
+        dataset_changed(added=new_frame)
+        record_undo("add_entry", [("remove", new_frame.index)])
+        duplicates = duplicate_warnings(new_frame)
+        persist_data()
+        trace_set(rows_after=len(df), duplicates=len(duplicates))
+    return {"message": "Entry added successfully!", "duplicates": duplicates}
+
+@app.post("/add/batch")
+def add_entries(batch: list[NewEntry]):
+    global df
+    # The whole list is validated by FastAPI before anything is touched, so a
+    # bad entry rejects the batch instead of leaving it half applied.
+    if not batch:
+        # Nothing to insert: no undo step, version bump or workbook write
+        raise HTTPException(status_code=422, detail="The batch has no entries")
+    with traced_request("add_batch"), locked_data(excel=True):
+        with timed_phase("build_rows"):
+            new_entries = [row for entry in batch for row in build_entry_rows(entry)]
+        trace_set(entries=len(batch), rows_before=len(df), rows_added=len(new_entries))
+        df, new_frame = insert_rows(df, new_entries)
+        dataset_changed(added=new_frame)
+        record_undo("add_batch", [("remove", new_frame.index)])
+        duplicates = duplicate_warnings(new_frame)
+        persist_data()
+        trace_set(rows_after=len(df), duplicates=len(duplicates))
+    return {
+        "message": "Entries added successfully!", "entries": len(batch), "rows": len(new_entries), "duplicates": duplicates,
+    }
 
 @app.post("/delete/")
 def delete_rows(delete_request: DeleteRows):
     global df
-    records = df.to_dict(orient="records")
-    new_records = [record for idx, record in enumerate(records) if idx not in delete_request.ids]
-    df = pd.DataFrame(new_records)
-    df.to_excel(DATA_FILE, index=False, columns=df.columns.tolist())
+    with traced_request("delete_rows"), locked_data(excel=True):
+        trace_set(rows_before=len(df), ids_requested=len(delete_request.ids))
+        with timed_phase("dataframe_rebuild"):
+            ids = [idx for idx in set(delete_request.ids) if 0 <= idx < len(df)]
+            keep = np.ones(len(df), dtype=bool)
+            keep[ids] = False
+            removed = df.index[~keep]
+            # Only the deleted rows are kept for undo, with their positions
+            undo_step = ("insert", (df[~keep], np.flatnonzero(~keep)))
+            df = df[keep]
+        dataset_changed(removed=removed)
+        record_undo("delete_rows", [undo_step])
+        persist_data()
+        trace_set(rows_after=len(df))
     return {"message": "Filas eliminadas exitosamente."}
 
+@app.patch("/edit/")
+def edit_cells(edit_request: EditCells):
+    with traced_request("edit_cells"), locked_data():
+        trace_set(rows=len(df), cells=len(edit_request.changes))
+        for change in edit_request.changes:
+            if change.column not in df.columns:
+                raise HTTPException(status_code=400, detail=f"Unknown column: {change.column}")
+            if not 0 <= change.id < len(df):
+                raise HTTPException(status_code=404, detail=f"Row not found: {change.id}")
+        journaled = STORAGE_BACKEND == "xlsx" and journal_in_sync
+        # Without the journal the edit rewrites DATA_FILE, so its Excel slot
+        # is reserved before any cell changes
+        with excel_slot() if STORAGE_BACKEND == "xlsx" and not journaled else nullcontext():
+            with timed_phase("apply_edits"):
+                old_cells = []
+                for change in edit_request.changes:
+                    old_cells.append((df.index[change.id], change.column, df.iat[change.id, df.columns.get_loc(change.column)]))
+                    set_cell(df, change.id, change.column, change.value)
+            dataset_changed(edited=df.index[sorted({change.id for change in edit_request.changes})])
+            # Undone in reverse, so a cell edited twice ends at its original value
+            record_undo("edit_cells", [("cells", old_cells[::-1])])
+            if journaled:
+                append_journal([change.model_dump() for change in edit_request.changes])
+            else:
+                persist_data()
+    return {"message": "Celdas actualizadas exitosamente.", "updated": len(edit_request.changes)}
+
 @app.post("/save/")
 def save_file():
-    df.to_excel(DATA_FILE, index=False, columns=df.columns.tolist())
+    with locked_data():
+        write_data_file()
     return {"message": "File saved successfully."}
 
+# ==========================
+# Undo / redo
+# ==========================
+# Each mutation records the inverse delta that undoes it, not a copy of df:
+#   ("remove", uids)               rows added by /add/ or a merge
+#   ("insert", (rows, positions))  rows deleted, with their former positions
+#   ("cells", [(uid, column, old)]) values overwritten by /edit/ or a merge
+#   ("replace", frame)             the frame a replace upload superseded
+# Applying a delta returns its own inverse, which goes on the other stack.
+# History is bounded by UNDO_MAX_STEPS and UNDO_MAX_BYTES (oldest dropped).
+UNDO_MAX_STEPS = int(os.environ.get("UNDO_MAX_STEPS", "50"))
+UNDO_MAX_BYTES = int(os.environ.get("UNDO_MAX_BYTES", str(256 * 1024 * 1024)))
+undo_stack = []
+redo_stack = []
+
+def frame_bytes(frame):
+    # Deep size for small frames; large ones (a superseded upload) are
+    # estimated, since a deep scan of every object cell takes a while
+    if len(frame) <= 10000:
+        return int(frame.memory_usage(index=True, deep=True).sum())
+    objects = sum(len(frame) for col in frame.columns if frame[col].dtype == object)
+    return int(frame.memory_usage(index=True).sum()) + objects * 64
+
+def delta_bytes(delta):
+    total = 0
+    for kind, payload in delta:
+        if kind == "replace":
+            total += frame_bytes(payload)
+        elif kind == "insert":
+            total += frame_bytes(payload[0]) + payload[1].nbytes
+        elif kind == "remove":
+            total += 8 * len(payload)
+        else:
+            total += 120 * len(payload)
+    return total
+
+def history_entry(operation, delta):
+    return {"operation": operation, "ts": time.strftime("%Y-%m-%dT%H:%M:%S"), "delta": delta, "bytes": delta_bytes(delta)}
+
+def trim_history(stack):
+    while stack and (len(stack) > UNDO_MAX_STEPS or sum(entry["bytes"] for entry in stack) > UNDO_MAX_BYTES):
+        stack.pop(0)
+
+def record_undo(operation, delta):
+    # Called with data_lock held, right after the mutation
+    undo_stack.append(history_entry(operation, delta))
+    redo_stack.clear()
+    trim_history(undo_stack)
+
+def apply_delta(delta):
+    global df
+    inverse = []
+    for kind, payload in delta:
+        if kind == "remove":
+            drop = df.index.isin(payload)
+            inverse.append(("insert", (df[drop], np.flatnonzero(drop))))
+            df = df[~drop]
+            # Columns only the removed rows brought in (e.g. "OBSERVACIONES"
+            # from /add/) go too; re-inserting the rows brings them back
+            extra = [col for col in df.columns if col not in REQUIRED_COLUMNS and df[col].isna().all()]
+            if extra:
+                df = df.drop(columns=extra)
+            dataset_changed(removed=pd.Index(payload))
+        elif kind == "insert":
+            rows, positions = payload
+            n, k = len(df), len(rows)
+            # positions are where the rows end up, in ascending order
+            order = np.insert(np.arange(n), positions - np.arange(k), n + np.arange(k))
+            df = pd.concat([df, rows]).iloc[order]
+            dataset_changed(added=rows)
+            inverse.append(("remove", rows.index))
+        elif kind == "cells":
+            positions = df.index.get_indexer([uid for uid, _, _ in payload])
+            old_cells = []
+            for pos, (uid, column, value) in zip(positions, payload):
+                if pos < 0 or column not in df.columns:
+                    continue
+                old_cells.append((uid, column, df.iat[pos, df.columns.get_loc(column)]))
+                set_cell(df, pos, column, value)
+            dataset_changed(edited=pd.Index(sorted({uid for uid, _, _ in old_cells})))
+            inverse.append(("cells", old_cells[::-1]))
+        else:
+            inverse.append(("replace", df))
+            df = payload
+            dataset_changed()
+    inverse.reverse()
+    return inverse
+
+def history_summary():
+    def describe(stack):
+        return [{"operation": entry["operation"], "ts": entry["ts"], "bytes": entry["bytes"]} for entry in reversed(stack)]
+    return {"undo": describe(undo_stack), "redo": describe(redo_stack)}
+
+def step_history(source, target, name):
+    with traced_request(name), locked_data(excel=True):
+        if not source:
+            raise HTTPException(status_code=409, detail=f"Nothing to {name}")
+        entry = source.pop()
+        trace_set(undone_operation=entry["operation"], rows_before=len(df))
+        target.append(history_entry(entry["operation"], apply_delta(entry["delta"])))
+        trim_history(target)
+        persist_data()
+        trace_set(rows_after=len(df))
+        return {"message": f"{name.capitalize()}: {entry['operation']}", "operation": entry["operation"], **history_summary()}
+
+@app.post("/undo/")
+def undo():
+    return step_history(undo_stack, redo_stack, "undo")
+
+@app.post("/redo/")
+def redo():
+    return step_history(redo_stack, undo_stack, "redo")
+
+@app.get("/history/")
+def get_history():
+    with data_lock:
+        return history_summary()
+
+dataset_memory = {"version": None, "bytes": 0}
+
+def format_histogram(lines, name, labels, buckets, total, count):
+    cumulative = 0
+    for bound, bucket_count in zip(LATENCY_BUCKETS, buckets):
+        cumulative += bucket_count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+    lines.append(f"{name}_sum{{{labels}}} {total}")
+    lines.append(f"{name}_count{{{labels}}} {count}")
+
+def process_rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return peak_rss_bytes()
+
+def peak_rss_bytes():
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+@app.get("/metrics")
+def metrics():
+    frame, version, catalog = df, data_version, catalogs
+    if dataset_memory["version"] != version:
+        # Deep memory usage walks every object cell, so it is computed once
+        # per data version rather than on every scrape
+        dataset_memory["bytes"] = int(frame.memory_usage(index=True, deep=True).sum())
+        dataset_memory["version"] = version
+    with metrics_lock:
+        requests = {key: (list(h.buckets), h.sum, h.count) for key, h in request_histograms.items()}
+        phases = {key: (list(h.buckets), h.sum, h.count) for key, h in phase_histograms.items()}
+        counts = dict(request_counts)
+        in_flight = requests_in_flight
+        ws_outcomes = dict(ws_search_stats)
+    with query_cache_lock:
+        cache_stats, cache_entries = dict(query_cache_stats), len(query_cache)
+    lines = [
+        "# HELP http_request_duration_seconds Request latency by route.",
+        "# TYPE http_request_duration_seconds histogram",
+    ]
+    for (method, route), values in sorted(requests.items()):
+        format_histogram(lines, "http_request_duration_seconds", f'method="{method}",route="{route}"', *values)
+    lines += ["# HELP http_requests_total Requests by route and status.", "# TYPE http_requests_total counter"]
+    for (method, route, status), count in sorted(counts.items()):
+        lines.append(f'http_requests_total{{method="{method}",route="{route}",status="{status}"}} {count}')
+    lines += [
+        "# HELP http_requests_in_flight Requests currently being handled.",
+        "# TYPE http_requests_in_flight gauge",
+        f"http_requests_in_flight {in_flight}",
+        "# HELP phase_duration_seconds Time spent in expensive internal phases.",
+        "# TYPE phase_duration_seconds histogram",
+    ]
+    for phase, values in sorted(phases.items()):
+        format_histogram(lines, "phase_duration_seconds", f'phase="{phase}"', *values)
+    lines += [
+        "# HELP dataset_rows Rows in the loaded dataset.",
+        "# TYPE dataset_rows gauge",
+        f"dataset_rows {len(frame)}",
+        "# HELP dataset_memory_bytes Deep memory usage of the loaded dataset.",
+        "# TYPE dataset_memory_bytes gauge",
+        f"dataset_memory_bytes {dataset_memory['bytes']}",
+        "# HELP dataset_version Number of changes applied to the dataset since startup.",
+        "# TYPE dataset_version counter",
+        f"dataset_version {version}",
+        "# HELP store_version Version of the shared SQLite store this process's data reflects.",
+        "# TYPE store_version gauge",
+        f"store_version {store_version or 0}",
+        "# HELP catalog_rows Rows in each maestro catalog.",
+        "# TYPE catalog_rows gauge",
+        f'catalog_rows{{catalog="procedimientos"}} {len(catalog["procedimientos"])}',
+        f'catalog_rows{{catalog="medicamentos"}} {len(catalog["medicamentos"])}',
+        f'catalog_rows{{catalog="diagnosticos"}} {len(catalog["diagnosticos"])}',
+        "# HELP catalog_version Number of catalog snapshots loaded since startup.",
+        "# TYPE catalog_version counter",
+        f"catalog_version {catalog['version']}",
+        "# HELP query_cache_requests_total Catalog search lookups by outcome (narrowed = filtered from a cached prefix).",
+        "# TYPE query_cache_requests_total counter",
+        *(f'query_cache_requests_total{{result="{result}"}} {cache_stats[result]}' for result in ("hit", "narrowed", "miss")),
+        "# HELP query_cache_evictions_total Entries evicted from the catalog search cache.",
+        "# TYPE query_cache_evictions_total counter",
+        f"query_cache_evictions_total {cache_stats['evictions']}",
+        "# HELP query_cache_entries Entries in the catalog search cache.",
+        "# TYPE query_cache_entries gauge",
+        f"query_cache_entries {cache_entries}",
+        "# HELP query_cache_bytes Bytes of cached match positions.",
+        "# TYPE query_cache_bytes gauge",
+        f"query_cache_bytes {cache_stats['bytes']}",
+        "# HELP ws_search_messages_total Autocomplete WebSocket queries by outcome.",
+        "# TYPE ws_search_messages_total counter",
+        *(f'ws_search_messages_total{{outcome="{outcome}"}} {count}' for outcome, count in ws_outcomes.items()),
+        "# HELP process_resident_memory_bytes Resident memory of this process.",
+        "# TYPE process_resident_memory_bytes gauge",
+        f"process_resident_memory_bytes {process_rss_bytes()}",
+    ]
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
 @app.on_event("shutdown")
 def save_state():
-    pass
+    shutdown_excel_pool()
+    close_store()
+
+# ==========================
+# Startup and health
+# ==========================
+# The server binds right away; catalogs and DATA_FILE are loaded by warm_up()
+# in a background thread. Until it finishes, API requests get a 503 and
+# /health/ready reports progress, while /health/live only says the process
+# is up.
+startup_state = {"status": "starting", "started_at": time.time(), "ready_at": None, "error": None, "steps": {}}
+startup_lock = threading.Lock()
+READY_EXEMPT_PREFIXES = ("/health/", "/metrics", "/debug/")
+
+def startup_step(name, status, **fields):
+    with startup_lock:
+        startup_state["steps"].setdefault(name, {}).update(status=status, **fields)
+
+def warm_up():
+    global df
+    startup_state["status"] = "loading"
+    try:
+        # Attaches the catalog files another worker (or a previous run) already
+        # wrote for the current maestro files; only missing ones are built
+        load_catalogs(progress=startup_step)
+        startup_step("data", "loading")
+        start = time.perf_counter()
+        frame = load_store() if STORAGE_BACKEND == "sqlite" else assign_row_uids(load_data_file())
+        with data_lock:
+            df = frame
+            dataset_changed(persist=False)
+        startup_step("data", "done", rows=len(df), seconds=round(time.perf_counter() - start, 3))
+    except Exception as e:
+        # Stay alive so /health/ready can say what went wrong
+        startup_state.update(status="failed", error=f"Error loading maestro files or data: {e}")
+        print(startup_state["error"], file=sys.stderr)
+        return
+    startup_state.update(status="ready", ready_at=time.time())
+    if CATALOG_WATCH_INTERVAL > 0:
+        threading.Thread(target=watch_catalogs, name="catalog-watch", daemon=True).start()
+
+def app_ready():
+    return startup_state["status"] == "ready"
+
+@app.on_event("startup")
+def start_warm_up():
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+class ReadinessMiddleware:
+    # Plain ASGI middleware: answers 503 for API routes until warm_up() is done.
+    # Static frontend files are served regardless.
+    def __init__(self, app):
+        self.app = app
+        self.api_paths = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and not app_ready():
+            if self.api_paths is None:
+                self.api_paths = {route.path for route in app.routes if isinstance(route, APIRoute)}
+            path = scope["path"]
+            if path in self.api_paths and not path.startswith(READY_EXEMPT_PREFIXES):
+                body = json.dumps({"detail": "Service is starting up", "status": startup_state["status"]}).encode()
+                await send({
+                    "type": "http.response.start",
+                    "status": 503,
+                    "headers": [(b"content-type", b"application/json"), (b"retry-after", b"1")],
+                })
+                await send({"type": "http.response.body", "body": body})
+                return
+        await self.app(scope, receive, send)
+
+app.add_middleware(ReadinessMiddleware)
+
+# Routes that only read the catalogs, so they never wait for a refresh
+CATALOG_ONLY_PATHS = {
+    "/search/", "/search/diagnostics/", "/search/diagnostics/code/", "/search/procedures/",
+    "/search/medications/", "/sync/diagnostic/", "/medications/full/", "/procedures/full/",
+    "/diagnostics/full/", "/catalogs/", "/catalogs/reload",
+}
+
+class StoreRefreshMiddleware:
+    # Plain ASGI middleware (SQLite backend only): before an API request that
+    # reads df, brings it up to date in a worker thread if another process
+    # changed the store. The check itself is one indexed read of the meta table.
+    def __init__(self, app):
+        self.app = app
+        self.api_paths = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and app_ready():
+            if self.api_paths is None:
+                self.api_paths = {route.path for route in app.routes if isinstance(route, APIRoute)} - CATALOG_ONLY_PATHS
+            path = scope["path"]
+            if path in self.api_paths and not path.startswith(READY_EXEMPT_PREFIXES) and poll_store_version() != store_version:
+                await asyncio.to_thread(refresh_from_store)
+        await self.app(scope, receive, send)
+
+if STORAGE_BACKEND == "sqlite":
+    app.add_middleware(StoreRefreshMiddleware)
+
+# ==========================
+# Catalog reload
+# ==========================
+# Replacing a maestro file takes effect without a restart, either through
+# POST /catalogs/reload or, with CATALOG_WATCH_INTERVAL set (seconds), by
+# polling the files' modification times. Unsaved edits in df are untouched.
+# The endpoint is closed (403) unless ADMIN_TOKEN is set; the poller needs none.
+CATALOG_WATCH_INTERVAL = float(os.environ.get("CATALOG_WATCH_INTERVAL", "0"))
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+catalog_reload_state = {"last_error": None, "last_reload_at": None}
+
+def reload_catalogs(force=False):
+    try:
+        reloaded = load_catalogs(force=force)
+    except Exception as e:
+        catalog_reload_state["last_error"] = f"Error loading maestro files: {e}"
+        raise
+    catalog_reload_state["last_error"] = None
+    if reloaded:
+        catalog_reload_state["last_reload_at"] = time.time()
+    return reloaded
+
+def watch_catalogs():
+    while True:
+        time.sleep(CATALOG_WATCH_INTERVAL)
+        try:
+            reloaded = reload_catalogs()
+        except Exception as e:
+            # Usually a file caught mid-copy; the next poll retries
+            print(f"Catalog reload failed: {e}", file=sys.stderr)
+            continue
+        if reloaded:
+            print(f"Reloaded catalogs: {', '.join(reloaded)}", file=sys.stderr)
+
+def catalog_status(catalog):
+    return {
+        "version": catalog["version"],
+        "loaded_at": catalog["loaded_at"],
+        "rows": {name: len(catalog[name]) for name in MAESTRO_FILES},
+        "files": {name: MAESTRO_FILES[name] for name in MAESTRO_FILES},
+        "last_error": catalog_reload_state["last_error"],
+    }
+
+@app.get("/catalogs/")
+def get_catalogs():
+    return catalog_status(catalogs)
+
+@app.post("/catalogs/reload")
+def post_catalogs_reload(force: bool = False, x_admin_token: str = Header(default="")):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Catalog reload is disabled (ADMIN_TOKEN is not set)")
+    if x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    try:
+        reloaded = reload_catalogs(force=force)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error loading maestro files: {e}")
+    status = catalog_status(catalogs)
+    status["reloaded"] = reloaded
+    return status
+
+@app.get("/health/live")
+def health_live():
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+def health_ready():
+    with startup_lock:
+        report = json.loads(json.dumps(startup_state))
+    report["uptime_seconds"] = round(time.time() - startup_state["started_at"], 3)
+    if report["status"] != "ready":
+        return JSONResponse(report, status_code=503)
+    return report
+
+# ==========================
+# Opt-in request profiling
+# ==========================
+# Profiling is only wired in when PROFILE_TOKEN is set; otherwise neither the
+# middleware nor the endpoint wrappers are installed. A request is profiled
+# when it carries "X-Profile: 1" (or ?profile=1) plus a matching
+# "X-Profile-Token" (or ?profile_token=), or when it is sampled.
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+if PROFILE_SAMPLE_RATE > 0 and not PROFILE_TOKEN:
+    # Without a token /debug/profiles stays closed, so sampled profiles could
+    # never be read back
+    print("PROFILE_SAMPLE_RATE is ignored: sampling needs PROFILE_TOKEN to be set", file=sys.stderr)
+    PROFILE_SAMPLE_RATE = 0.0
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", "50"))
+
+# Worker-thread profilers of the request being profiled; sync endpoints run in
+# the threadpool, which cProfile in the event loop thread cannot see
+active_profilers = contextvars.ContextVar("active_profilers", default=None)
+profiling_busy = threading.Lock()
+
+def profile_requested(scope):
+    headers = dict(scope["headers"])
+    query = dict(
+        part.split("=", 1) for part in scope.get("query_string", b"").decode("latin-1").split("&") if "=" in part
+    )
+    wanted = headers.get(b"x-profile") == b"1" or query.get("profile") == "1"
+    if wanted and PROFILE_TOKEN:
+        token = headers.get(b"x-profile-token", b"").decode("latin-1") or query.get("profile_token", "")
+        if token == PROFILE_TOKEN:
+            return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+def save_profile(scope, profiler, worker_profilers, elapsed):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stats = pstats.Stats(profiler)
+    for worker in worker_profilers:
+        stats.add(worker)
+    route = scope.get("route")
+    slug = re.sub(r"[^A-Za-z0-9]+", "-", route.path if route is not None else scope["path"]).strip("-") or "root"
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{scope['method']}-{slug}-{int(elapsed * 1000)}ms.prof"
+    stats.dump_stats(os.path.join(PROFILE_DIR, name))
+    profiles = sorted(
+        (entry for entry in os.scandir(PROFILE_DIR) if entry.name.endswith(".prof")),
+        key=lambda entry: entry.stat().st_mtime,
+    )
+    for entry in profiles[:-PROFILE_MAX_FILES]:
+        os.remove(entry.path)
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not profile_requested(scope):
+            await self.app(scope, receive, send)
+            return
+        # One profiled request at a time: cProfile cannot nest in a thread
+        if not profiling_busy.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+        worker_profilers = []
+        token = active_profilers.set(worker_profilers)
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profiler.disable()
+            active_profilers.reset(token)
+            try:
+                save_profile(scope, profiler, worker_profilers, time.perf_counter() - start)
+            finally:
+                profiling_busy.release()
+
+def profiled_endpoint(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profilers = active_profilers.get()
+        if profilers is None:
+            return func(*args, **kwargs)
+        profiler = cProfile.Profile()
+        profilers.append(profiler)
+        return profiler.runcall(func, *args, **kwargs)
+    return wrapper
+
+def check_profile_token(token):
+    # /debug/ exposes profiles, memory contents and tracemalloc control, so it
+    # stays closed until a token is configured
+    if not PROFILE_TOKEN:
+        raise HTTPException(status_code=403, detail="Debug endpoints are disabled (PROFILE_TOKEN is not set)")
+    if token != PROFILE_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid profile token")
+
+@app.get("/debug/profiles")
+def list_profiles(x_profile_token: str = Header(default="")):
+    check_profile_token(x_profile_token)
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = sorted(
+        (entry for entry in os.scandir(PROFILE_DIR) if entry.name.endswith(".prof")),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True,
+    )
+    return [
+        {"name": entry.name, "size": entry.stat().st_size, "created": entry.stat().st_mtime}
+        for entry in profiles
+    ]
+
+@app.get("/debug/profiles/{name}")
+def get_profile(name: str, format: str = "prof", limit: int = 40, x_profile_token: str = Header(default="")):
+    check_profile_token(x_profile_token)
+    path = os.path.join(PROFILE_DIR, os.path.basename(name))
+    if not name.endswith(".prof") or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "text":
+        out = StringIO()
+        pstats.Stats(path, stream=out).sort_stats("cumulative").print_stats(limit)
+        return PlainTextResponse(out.getvalue())
+    # Raw pstats data, e.g. for snakeviz or flameprof
+    return FileResponse(path=path, filename=name, media_type="application/octet-stream")
+
+# ==========================
+# Memory introspection
+# ==========================
+def deep_sizeof(obj, seen=None):
+    # Approximate retained size of nested containers, numpy arrays and pandas
+    # objects; shared objects are counted once
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, (pd.DataFrame, pd.Series, pd.Index)):
+        usage = obj.memory_usage(deep=True)
+        return int(usage.sum()) if isinstance(usage, pd.Series) else int(usage)
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes + sys.getsizeof(obj) if obj.dtype != object else sys.getsizeof(obj) + sum(
+            deep_sizeof(item, seen) for item in obj
+        )
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    return size
+
+def frame_memory(frame):
+    usage = frame.memory_usage(index=True, deep=True)
+    return {
+        "rows": len(frame),
+        "total_bytes": int(usage.sum()),
+        "columns": {str(col).replace("\n", " ").strip(): int(size) for col, size in usage.items()},
+    }
+
+@app.get("/debug/memory")
+def debug_memory(tracemalloc_action: str = None, limit: int = 25, x_profile_token: str = Header(default="")):
+    check_profile_token(x_profile_token)
+    report = {
+        "process": {"rss_bytes": process_rss_bytes(), "peak_rss_bytes": peak_rss_bytes()},
+        "dataset": frame_memory(df),
+        "catalogs": {
+            name: {"rows": len(catalogs[name]), "mapped_bytes": catalogs[name].nbytes, "file": catalogs[name].path}
+            for name in MAESTRO_FILES
+        },
+        "caches": {
+            "data_indexes_bytes": deep_sizeof([data_indexes["equality"], data_indexes["dates"]]),
+            "text_index_bytes": deep_sizeof(text_index),
+            "text_index_terms": len(text_index["postings"]),
+            "export_cache_entries": len(export_cache),
+            "query_cache_entries": len(query_cache),
+            "query_cache_bytes": query_cache_stats["bytes"],
+            "metrics_bytes": deep_sizeof([request_histograms, request_counts, phase_histograms]),
+        },
+    }
+    # tracemalloc slows allocations down, so it only runs between an explicit
+    # "start" and "stop"; "snapshot" reports the top allocation sites
+    if tracemalloc_action == "start":
+        tracemalloc.start(25)
+    elif tracemalloc_action == "stop":
+        tracemalloc.stop()
+    elif tracemalloc_action == "snapshot":
+        if not tracemalloc.is_tracing():
+            raise HTTPException(status_code=409, detail="tracemalloc is not running; call with tracemalloc_action=start first")
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ])
+        report["tracemalloc_top"] = [
+            {"location": str(stat.traceback[0]), "size_bytes": stat.size, "count": stat.count}
+            for stat in snapshot.statistics("lineno")[:limit]
+        ]
+    elif tracemalloc_action is not None:
+        raise HTTPException(status_code=400, detail=f"Unknown tracemalloc_action: {tracemalloc_action}")
+    report["tracemalloc"] = {"tracing": tracemalloc.is_tracing()}
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        report["tracemalloc"].update(current_bytes=current, peak_bytes=peak)
+    return report
+
+if PROFILE_TOKEN:
+    for route in app.routes:
+        if isinstance(route, APIRoute) and not asyncio.iscoroutinefunction(route.dependant.call):
+            route.dependant.call = profiled_endpoint(route.dependant.call)
+    app.add_middleware(ProfilingMiddleware)
+
+# Registered after every other middleware, so readiness 503s and the time spent
+# in StoreRefreshMiddleware and profiling show up in the per-route histograms
+app.add_middleware(MetricsMiddleware)
 
 build_path = os.path.join(os.path.dirname(__file__), "frontend", "build")
 if os.path.exists(build_path):
@@ -393,5 +2923,7 @@ else:
     print("Warning: React build directory not found. Frontend will not be served.")
 
 if __name__ == "__main__":
+    # Needed for the Excel worker processes in a frozen (PyInstaller) build
+    multiprocessing.freeze_support()
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,74 @@
+import io
+import os
+import sys
+import shutil
+import tempfile
+import importlib
+import pytest
+import pandas as pd
+from fastapi.testclient import TestClient
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAESTRO_FILES = ["maestro_procedimientos.xlsx", "maestro_medicamentos.xlsx", "maestro_diagnosticos.xlsx"]
+
+sys.path.insert(0, APP_DIR)
+# Excel jobs run inline, nothing is traced to disk, and the catalog files are
+# built once for the whole session (the maestro copies keep their mtimes)
+os.environ["EXCEL_WORKERS"] = "0"
+os.environ["TRACE_LOG_FILE"] = ""
+os.environ["CATALOG_CACHE_DIR"] = tempfile.mkdtemp(prefix="iess-catalogs-")
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch, request):
+    # A fresh main module in an empty working directory, warmed up. Use
+    # @pytest.mark.parametrize("app", ["sqlite"], indirect=True) for the
+    # SQLite backend.
+    for name in MAESTRO_FILES:
+        shutil.copy2(os.path.join(APP_DIR, name), tmp_path / name)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("STORAGE_BACKEND", getattr(request, "param", "xlsx"))
+    if "main" in sys.modules:
+        main = importlib.reload(sys.modules["main"])
+    else:
+        main = importlib.import_module("main")
+    main.warm_up()
+    yield main
+    main.close_store()
+
+
+@pytest.fixture
+def client(app):
+    # Not entered as a context manager: warm_up() already ran, so the startup
+    # hook must not start a second one
+    return TestClient(app.app)
+
+
+def sample_frame(patients=6, days=3, lines=3):
+    # Blocks of lines per patient and attention day, as in an archivo plano
+    rows = []
+    for p in range(patients):
+        for d in range(days):
+            for line in range(lines):
+                rows.append({
+                    "FECHA ANTENCION": pd.Timestamp("2024-10-01") + pd.Timedelta(days=d + p % 2),
+                    "CEDULA": 1700000000 + p,
+                    "NOMBRE DE BENEFICIARIO": f"PACIENTE {p:02d}",
+                    "CODIGO": f"C{line}",
+                    "DESCRIPCIÓN": f"PROCEDIMIENTO {line}",
+                    "CANTIDAD": line + 1,
+                    "OBSERVACIONES": "CONTROL" if line == 0 else "",
+                })
+    return pd.DataFrame(rows)
+
+
+def xlsx_bytes(frame):
+    buffer = io.BytesIO()
+    frame.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+def upload(client, frame, mode="replace"):
+    response = client.post("/upload/", params={"mode": mode}, files={"file": ("month.xlsx", xlsx_bytes(frame))})
+    assert response.status_code == 200, response.text
+    return response.json()
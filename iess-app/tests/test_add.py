@@ -0,0 +1,46 @@
+import pandas as pd
+
+from conftest import sample_frame, upload
+
+
+def test_batch_inserts_every_entry_with_one_write(app, client, monkeypatch):
+    upload(client, sample_frame(patients=3))
+    writes = []
+    write_data_file = app.write_data_file
+
+    def counted_write(*args, **kwargs):
+        writes.append(len(app.df))
+        return write_data_file(*args, **kwargs)
+
+    monkeypatch.setattr(app, "write_data_file", counted_write)
+    batch = [
+        {"paciente": "PACIENTE 01", "procedimientos": [{"name": "CURACION", "code": "97597", "quantity": 1}]},
+        {"paciente": "ANA", "procedimientos": [{"name": "CONSULTA", "code": "99203", "quantity": 1}],
+         "insumos": [{"name": "GASA", "code": "", "quantity": 2}]},
+    ]
+    response = client.post("/add/batch", json=batch)
+    assert response.status_code == 200
+    assert (response.json()["entries"], response.json()["rows"]) == (2, 3)
+    assert writes == [30]
+    # Rows for a known patient go after their last row, new patients at the end
+    names = app.df["NOMBRE DE BENEFICIARIO"].tolist()
+    assert names == ["PACIENTE 00"] * 9 + ["PACIENTE 01"] * 10 + ["PACIENTE 02"] * 9 + ["ANA"] * 2
+    assert app.df["CODIGO"].iloc[18] == "97597"
+    assert len(pd.read_excel(app.DATA_FILE)) == 30
+
+
+def test_invalid_entry_rejects_the_whole_batch(app, client):
+    upload(client, sample_frame(patients=3))
+    batch = [
+        {"paciente": "PACIENTE 01", "procedimientos": [{"name": "CURACION", "code": "97597", "quantity": 1}]},
+        {"paciente": "ANA", "procedimientos": [{"name": "CONSULTA", "quantity": "mucho"}]},
+    ]
+    assert client.post("/add/batch", json=batch).status_code == 422
+    assert len(app.df) == 27
+
+
+def test_empty_batch_changes_nothing(app, client):
+    upload(client, sample_frame(patients=3))
+    version, history = app.data_version, len(app.undo_stack)
+    assert client.post("/add/batch", json=[]).status_code == 422
+    assert (app.data_version, len(app.undo_stack), len(app.df)) == (version, history, 27)
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl import load_workbook
+
+from conftest import sample_frame, upload
+
+
+def assert_bands_match_rebuild(app):
+    expected = np.cumsum(app.band_starts(app.df, np.arange(len(app.df)))) - 1
+    assert app.band_index["starts"].index.equals(app.df.index)
+    np.testing.assert_array_equal(app.band_ids(app.df), expected)
+
+
+def test_new_patient_rows_share_one_band(app, client):
+    upload(client, sample_frame(patients=2))
+    entry = {"paciente": "ANA", "procedimientos": [
+        {"name": "CURACION", "code": "97597", "quantity": 1},
+        {"name": "CONSULTA", "code": "99203", "quantity": 1},
+    ]}
+    assert client.post("/add/", json=entry).status_code == 200
+    rows = [row for row in client.get("/data/").json() if row["NOMBRE DE BENEFICIARIO"] == "ANA"]
+    assert len(rows) == 2 and rows[0]["band"] == rows[1]["band"]
+    # The same band in the saved workbook, in every column
+    ws = load_workbook(app.DATA_FILE).active
+    fills = {ws.cell(row=row["id"] + 2, column=col).fill.fgColor.rgb for row in rows for col in (1, ws.max_column)}
+    assert len(fills) == 1
+
+
+def test_saved_workbook_is_filled_by_band(app, client):
+    upload(client, sample_frame(patients=2))
+    assert client.post("/save/").status_code == 200
+    ws = load_workbook(app.DATA_FILE).active
+    fills = app.excel_worker.get_color_fills()
+    date_column = app.df.columns.get_loc("FECHA ANTENCION") + 1
+    for row, band in enumerate(app.band_ids(app.df).tolist(), start=2):
+        expected = fills[band % len(fills)]
+        assert {(cell.fill.fgColor.rgb, cell.fill.fill_type) for cell in ws[row]} == {(expected.fgColor.rgb, expected.fill_type)}
+        # Coloring leaves the date format pandas wrote alone
+        assert ws.cell(row=row, column=date_column).is_date
+
+
+def test_empty_keys_compare_equal():
+    import main
+    frame = pd.DataFrame({
+        "FECHA ANTENCION": [None, np.nan, "", pd.NaT, pd.Timestamp("2024-10-01"), ""],
+        "NOMBRE DE BENEFICIARIO": ["ANA"] * 6,
+    })
+    np.testing.assert_array_equal(
+        main.band_starts(frame, np.arange(len(frame))), [True, False, False, False, True, True]
+    )
+
+
+@pytest.mark.parametrize("app", ["xlsx", "sqlite"], indirect=True)
+def test_maintained_band_ids_match_rebuild(app, client):
+    source = sample_frame()
+    upload(client, source)
+    assert_bands_match_rebuild(app)
+    steps = [
+        ("post", "/add/", {"paciente": "PACIENTE 03", "procedimientos": [{"name": "CURACION", "code": "97597", "quantity": 1}]}),
+        ("post", "/add/", {"paciente": "ANA", "insumos": [{"name": "GASA", "code": "", "quantity": 1}] * 2}),
+        ("post", "/delete/", {"ids": [0, 4, 5, 6, 20]}),
+        ("patch", "/edit/", {"changes": [
+            {"id": 3, "column": "NOMBRE DE BENEFICIARIO", "value": "OTRO"},
+            {"id": 10, "column": "FECHA ANTENCION", "value": None},
+        ]}),
+    ]
+    for method, path, body in steps:
+        assert client.request(method, path, json=body).status_code == 200
+        assert_bands_match_rebuild(app)
+    part = source.iloc[9:15].copy()
+    part["CANTIDAD"] = 77
+    part.loc[part.index[:2], "CODIGO"] = "NUEVO"
+    upload(client, part, mode="merge")
+    assert_bands_match_rebuild(app)
+    for path in ["/undo/"] * 3 + ["/redo/"] * 2:
+        assert client.post(path).status_code == 200
+        assert_bands_match_rebuild(app)
@@ -0,0 +1,12 @@
+def test_catalog_reload_needs_a_configured_token(app, client, monkeypatch):
+    reloads = []
+    monkeypatch.setattr(app, "reload_catalogs", lambda force=False: reloads.append(force) or [])
+    assert client.post("/catalogs/reload").status_code == 403
+    assert client.post("/catalogs/reload", headers={"X-Admin-Token": ""}).status_code == 403
+    monkeypatch.setattr(app, "ADMIN_TOKEN", "secret")
+    assert client.post("/catalogs/reload", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert reloads == []
+    response = client.post("/catalogs/reload?force=true", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    assert response.json()["reloaded"] == []
+    assert reloads == [True]
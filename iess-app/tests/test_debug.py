@@ -0,0 +1,46 @@
+import os
+import importlib
+import tracemalloc
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.mark.parametrize("path", ["/debug/memory?tracemalloc_action=start", "/debug/profiles", "/debug/profiles/x.prof"])
+def test_debug_routes_need_a_configured_token(app, client, monkeypatch, path):
+    assert client.get(path).status_code == 403
+    assert client.get(path, headers={"X-Profile-Token": ""}).status_code == 403
+    assert not tracemalloc.is_tracing()
+    monkeypatch.setattr(app, "PROFILE_TOKEN", "secret")
+    assert client.get(path, headers={"X-Profile-Token": "wrong"}).status_code == 403
+    assert client.get(path, headers={"X-Profile-Token": "secret"}).status_code in (200, 404)
+    tracemalloc.stop()
+
+
+def reload_with(app, monkeypatch, **env):
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    main = importlib.reload(app)
+    main.warm_up()
+    return main
+
+
+def profiling_installed(main):
+    return any(middleware.cls is main.ProfilingMiddleware for middleware in main.app.user_middleware)
+
+
+def test_sampling_without_a_token_is_refused(app, monkeypatch, capsys):
+    main = reload_with(app, monkeypatch, PROFILE_SAMPLE_RATE="1")
+    assert "PROFILE_SAMPLE_RATE is ignored" in capsys.readouterr().err
+    assert main.PROFILE_SAMPLE_RATE == 0 and not profiling_installed(main)
+    assert TestClient(main.app).get("/data/").status_code == 200
+    assert not os.path.exists(main.PROFILE_DIR)
+
+
+def test_sampled_profiles_can_be_listed_with_a_token(app, monkeypatch):
+    main = reload_with(app, monkeypatch, PROFILE_SAMPLE_RATE="1", PROFILE_TOKEN="secret")
+    assert profiling_installed(main)
+    client = TestClient(main.app)
+    assert client.get("/data/").status_code == 200
+    profiles = client.get("/debug/profiles", headers={"X-Profile-Token": "secret"}).json()
+    assert any("-GET-data-" in str(profile) for profile in profiles)
@@ -0,0 +1,35 @@
+import pandas as pd
+import pytest
+
+from conftest import sample_frame, upload
+
+MUTATIONS = [
+    ("post", "/add/", {"paciente": "PACIENTE 01", "procedimientos": [{"name": "CURACION", "code": "97597", "quantity": 1}]}),
+    ("post", "/add/batch", [{"paciente": "PACIENTE 02", "insumos": [{"name": "GASA", "code": "", "quantity": 2}]}]),
+    ("post", "/delete/", {"ids": [0, 1]}),
+    # Right after an upload the journal is out of sync, so edits rewrite the file
+    ("patch", "/edit/", {"changes": [{"id": 3, "column": "CANTIDAD", "value": 9}]}),
+]
+
+
+@pytest.mark.parametrize("method, path, body", MUTATIONS)
+def test_full_excel_queue_refuses_mutation_before_changing_data(app, client, monkeypatch, method, path, body):
+    upload(client, sample_frame())
+    before, version, history = app.df.copy(), app.data_version, len(app.undo_stack)
+    monkeypatch.setattr(app, "EXCEL_QUEUE_TIMEOUT", 0.1)
+    taken = 0
+    while app.excel_slots.acquire(blocking=False):
+        taken += 1
+    try:
+        response = client.request(method, path, json=body)
+    finally:
+        for _ in range(taken):
+            app.excel_slots.release()
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
+    pd.testing.assert_frame_equal(app.df, before)
+    assert app.data_version == version
+    assert len(app.undo_stack) == history
+    # The retry the client was told to make applies the change once
+    assert client.request(method, path, json=body).status_code == 200
+    assert len(app.undo_stack) == history + 1
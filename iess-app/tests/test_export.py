@@ -0,0 +1,56 @@
+import os
+import threading
+
+from conftest import sample_frame, upload
+
+
+def edit(client, value):
+    response = client.patch("/edit/", json={"changes": [{"id": 0, "column": "DESCRIPCIÓN", "value": value}]})
+    assert response.status_code == 200
+
+
+def test_previous_export_outlives_one_generation(app, client):
+    upload(client, sample_frame())
+    # Responses built but not streamed yet, as when a new version is
+    # generated while they are still queued
+    first = app.download_file("csv", True)
+    edit(client, "V2")
+    second = app.download_file("csv", True)
+    assert first.path != second.path
+    assert os.path.exists(first.path) and os.path.exists(second.path)
+    response = client.get("/download/", params={"format": "csv"})
+    assert response.status_code == 200 and "V2" in response.text
+    edit(client, "V3")
+    assert client.get("/download/", params={"format": "csv"}).status_code == 200
+    assert not os.path.exists(first.path)
+    assert os.path.exists(second.path)
+    assert sorted({key[0] for key in app.export_cache}) == [app.data_version - 1, app.data_version]
+
+
+class EditingCache(dict):
+    # Starts an edit right after get_export() has read data_version
+    def __init__(self, client):
+        super().__init__()
+        self.client = client
+        self.editor = None
+
+    def get(self, key, default=None):
+        if self.editor is None:
+            self.editor = threading.Thread(target=edit, args=(self.client, "V2"))
+            self.editor.start()
+            self.editor.join(timeout=0.5)
+        return super().get(key, default)
+
+
+def test_export_matches_the_version_it_is_named_after(app, client, monkeypatch):
+    upload(client, sample_frame())
+    edit(client, "V1")
+    cache = EditingCache(client)
+    monkeypatch.setattr(app, "export_cache", cache)
+    version = app.data_version
+    response = client.get("/download/", params={"format": "csv"})
+    cache.editor.join(timeout=10)
+    assert response.status_code == 200
+    assert "V1" in response.text and "V2" not in response.text
+    assert cache[(version, "csv", False)].endswith(f"-v{version}.csv")
+    assert app.data_version == version + 1
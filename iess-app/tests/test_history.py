@@ -0,0 +1,123 @@
+import os
+import copy
+import importlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import sample_frame, upload, xlsx_bytes
+
+
+def index_state(app):
+    # Everything dataset_changed() maintains, in comparable form
+    dates = {
+        name: dict(zip(index["uids"].tolist(), index["sorted"].tolist()))
+        for name, index in app.data_indexes["dates"].items()
+    }
+    for index in app.data_indexes["dates"].values():
+        assert (np.diff(index["sorted"]) >= np.timedelta64(0)).all()
+    return copy.deepcopy({
+        "text": app.text_index,
+        "duplicates": app.duplicate_index,
+        "bands": app.band_index["starts"].to_dict(),
+        "equality": app.data_indexes["equality"],
+        "dates": dates,
+    })
+
+
+def assert_indexes_match_rebuild(app):
+    assert app.data_indexes["frame"] is app.df
+    assert app.band_index["starts"].index.equals(app.df.index)
+    maintained = index_state(app)
+    app.rebuild_text_index()
+    app.rebuild_duplicate_index()
+    app.rebuild_band_index()
+    app.rebuild_data_indexes()
+    assert maintained == index_state(app)
+
+
+def assert_matches_store(app):
+    if app.STORAGE_BACKEND == "sqlite":
+        stored = app.read_store(app.connect_store())
+        pd.testing.assert_frame_equal(app.df, stored, check_dtype=False)
+
+
+def comparable(frame):
+    # Values as text, with every kind of empty cell ("", None, NaN, NaT) alike
+    frame = frame.astype(object)
+    return frame.where(frame.notna() & (frame != ""), None).astype(str)
+
+
+def merge_part(source):
+    part = source.iloc[9:15].copy()
+    part["CANTIDAD"] = 77
+    part.loc[part.index[:2], "CODIGO"] = "NUEVO"
+    return part
+
+
+@pytest.mark.parametrize("app", ["xlsx", "sqlite"], indirect=True)
+def test_undo_and_redo_restore_data_and_indexes(app, client):
+    source = sample_frame()
+    upload(client, source)
+    states = [app.df.copy()]
+    steps = [
+        lambda: client.post("/add/", json={"paciente": "PACIENTE 02", "procedimientos": [
+            {"name": "CURACION", "code": "97597", "quantity": 1}]}),
+        lambda: client.post("/delete/", json={"ids": [0, 1, 2, 30]}),
+        lambda: client.patch("/edit/", json={"changes": [
+            {"id": 3, "column": "NOMBRE DE BENEFICIARIO", "value": "PACIENTE 05"},
+            {"id": 4, "column": "DESCRIPCIÓN", "value": "CONTROL POSTOPERATORIO"},
+            {"id": 8, "column": "FECHA ANTENCION", "value": "2024-12-01"}]}),
+        lambda: client.post("/upload/", params={"mode": "merge"}, files={"file": ("m.xlsx", xlsx_bytes(merge_part(source)))}),
+        lambda: client.post("/upload/", files={"file": ("r.xlsx", xlsx_bytes(sample_frame(patients=3)))}),
+    ]
+    for step in steps:
+        assert step().status_code == 200
+        assert_indexes_match_rebuild(app)
+        assert_matches_store(app)
+        states.append(app.df.copy())
+
+    for expected in reversed(states[:-1]):
+        assert client.post("/undo/").status_code == 200
+        pd.testing.assert_frame_equal(app.df, expected, check_dtype=False)
+        assert_indexes_match_rebuild(app)
+        assert_matches_store(app)
+    # Only the first upload is left to undo
+    assert [entry["operation"] for entry in app.undo_stack] == ["upload"]
+
+    for expected in states[1:]:
+        assert client.post("/redo/").status_code == 200
+        pd.testing.assert_frame_equal(app.df, expected, check_dtype=False)
+        assert_indexes_match_rebuild(app)
+        assert_matches_store(app)
+    assert client.post("/redo/").status_code == 409
+
+
+@pytest.mark.parametrize("app", ["xlsx", "sqlite"], indirect=True)
+def test_restart_restores_the_data(app, client):
+    # SQLite: read back from data.sqlite. xlsx: data.xlsx plus the journal of
+    # edits made since it was written.
+    source = sample_frame()
+    upload(client, source)
+    assert client.post("/save/").status_code == 200
+    assert client.post("/add/", json={"paciente": "PACIENTE 04", "procedimientos": [
+        {"name": "CURACION", "code": "97597", "quantity": 2}]}).status_code == 200
+    assert client.post("/delete/", json={"ids": [5]}).status_code == 200
+    assert client.post("/undo/").status_code == 200
+    assert client.patch("/edit/", json={"changes": [
+        {"id": 6, "column": "DESCRIPCIÓN", "value": "REVISADO"},
+        {"id": 7, "column": "CANTIDAD", "value": 5}]}).status_code == 200
+    if app.STORAGE_BACKEND == "xlsx":
+        assert app.journal_in_sync and os.path.exists(app.JOURNAL_FILE)
+    expected = app.df.reset_index(drop=True)
+    app.close_store()
+    main = importlib.reload(app)
+    main.warm_up()
+    restored = main.df.reset_index(drop=True)
+    # /add/ brings in an empty "OBSERVACIONES" next to "OBSERVACIONES\n",
+    # which loading folds away
+    columns = [col for col in expected.columns if col in restored.columns]
+    assert restored["DESCRIPCIÓN"].iloc[6] == "REVISADO"
+    pd.testing.assert_frame_equal(comparable(restored[columns]), comparable(expected[columns]))
+    assert_indexes_match_rebuild(main)
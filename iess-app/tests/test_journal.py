@@ -0,0 +1,47 @@
+import os
+import importlib
+
+from conftest import sample_frame, upload
+
+
+def reload_app(app):
+    # A restart in the same working directory: DATA_FILE plus the journal
+    app.close_store()
+    main = importlib.reload(app)
+    main.warm_up()
+    return main
+
+
+def test_edits_are_journaled_and_replayed(app, client):
+    upload(client, sample_frame())
+    assert client.post("/save/").status_code == 200
+    response = client.patch("/edit/", json={"changes": [{"id": 4, "column": "DESCRIPCIÓN", "value": "REVISADO"}]})
+    assert response.status_code == 200
+    assert os.path.exists(app.JOURNAL_FILE)
+    expected = app.df.reset_index(drop=True)
+    main = reload_app(app)
+    assert main.df["DESCRIPCIÓN"].iloc[4] == "REVISADO"
+    assert main.df.reset_index(drop=True)["DESCRIPCIÓN"].tolist() == expected["DESCRIPCIÓN"].tolist()
+
+
+def test_failed_write_stops_journaling(app, client, monkeypatch):
+    upload(client, sample_frame())
+    assert client.post("/save/").status_code == 200
+    assert app.journal_in_sync
+
+    def broken_write(*args):
+        raise OSError("disk full")
+
+    # Only the stub is undone here; the fixture's chdir and environment stay
+    with monkeypatch.context() as m:
+        m.setattr(app.excel_worker, "write_workbook", broken_write)
+        assert client.post("/delete/", json={"ids": [0, 1, 2]}).status_code == 500
+    assert not app.journal_in_sync
+    # Row 0 of df is not row 0 of data.xlsx any more: the edit has to rewrite
+    # the file instead of journaling an id that would land on the wrong row
+    assert client.patch("/edit/", json={"changes": [{"id": 0, "column": "DESCRIPCIÓN", "value": "X"}]}).status_code == 200
+    assert not os.path.exists(app.JOURNAL_FILE)
+    expected = app.df.reset_index(drop=True)
+    main = reload_app(app)
+    assert len(main.df) == len(expected)
+    assert main.df["DESCRIPCIÓN"].tolist() == expected["DESCRIPCIÓN"].tolist()
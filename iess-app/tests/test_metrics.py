@@ -0,0 +1,11 @@
+def test_metrics_count_requests_answered_by_other_middleware(app, client, monkeypatch):
+    monkeypatch.setitem(app.startup_state, "status", "loading")
+    assert client.get("/data/").status_code == 503
+    monkeypatch.setitem(app.startup_state, "status", "ready")
+    assert client.get("/data/").status_code == 200
+    assert client.get("/nowhere/").status_code == 404
+    text = client.get("/metrics").text
+    assert 'http_requests_total{method="GET",route="/data/",status="503"} 1' in text
+    assert 'http_requests_total{method="GET",route="/data/",status="200"} 1' in text
+    assert 'http_requests_total{method="GET",route="unmatched",status="404"} 1' in text
+    assert 'http_request_duration_seconds_count{method="GET",route="/data/"} 2' in text
@@ -0,0 +1,54 @@
+import numpy as np
+
+from conftest import sample_frame, upload
+
+
+def expected_ids(app, column, value):
+    keys = app.df[column].map(app.normalize_key)
+    return np.flatnonzero((keys == app.normalize_key(value)).to_numpy()).tolist()
+
+
+def query_ids(client, **params):
+    response = client.get("/data/query", params={"limit": 10000, **params})
+    assert response.status_code == 200, response.text
+    return [row["id"] for row in response.json()["rows"]]
+
+
+def test_indexes_follow_changes(app, client):
+    upload(client, sample_frame())
+    steps = [
+        ("post", "/add/", {"paciente": "PACIENTE 01", "procedimientos": [{"name": "CURACION", "code": "97597", "quantity": 1}]}),
+        ("post", "/delete/", {"ids": [0, 1, 2, 40]}),
+        ("patch", "/edit/", {"changes": [
+            {"id": 3, "column": "NOMBRE DE BENEFICIARIO", "value": "paciente 05"},
+            {"id": 7, "column": "FECHA ANTENCION", "value": "2024-11-20"},
+        ]}),
+    ]
+    for method, path, body in steps + [("post", "/undo/", None), ("post", "/redo/", None)]:
+        assert client.request(method, path, json=body).status_code == 200
+        for name in ["PACIENTE 01", "PACIENTE 05"]:
+            assert query_ids(client, paciente=name.lower()) == expected_ids(app, "NOMBRE DE BENEFICIARIO", name)
+        assert query_ids(client, codigo="97597") == expected_ids(app, "CODIGO", "97597")
+        dates = app.parse_dates(app.df["FECHA ANTENCION"])
+        in_range = (dates >= "2024-10-02") & (dates <= "2024-11-30")
+        assert query_ids(client, fecha_atencion_desde="2024-10-02", fecha_atencion_hasta="2024-11-30") == \
+            np.flatnonzero(in_range.to_numpy()).tolist()
+        order = dates.reset_index(drop=True).sort_values(ascending=False, kind="stable", na_position="last")
+        assert query_ids(client, sort="FECHA ANTENCION", descending=True) == order.index.tolist()
+
+
+def test_query_reads_the_frame_it_indexed(app, client, monkeypatch):
+    upload(client, sample_frame())
+    uid_positions = app.uid_positions
+
+    def delete_meanwhile(frame, uids):
+        # Another request removes most rows between the lookup and the paging
+        if len(app.df) == len(frame):
+            assert client.post("/delete/", json={"ids": list(range(40))}).status_code == 200
+        return uid_positions(frame, uids)
+
+    monkeypatch.setattr(app, "uid_positions", delete_meanwhile)
+    response = client.get("/data/query", params={"paciente": "PACIENTE 05", "sort": "CANTIDAD"})
+    assert response.status_code == 200
+    assert response.json()["total"] == 9
+    assert len(app.df) == len(sample_frame()) - 40
@@ -0,0 +1,72 @@
+import os
+import importlib.util
+
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import APP_DIR, sample_frame, upload, xlsx_bytes
+
+
+def other_worker():
+    # A second process on the same data.sqlite: its own copy of the module
+    spec = importlib.util.spec_from_file_location("other_worker", os.path.join(APP_DIR, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.warm_up()
+    return module
+
+
+def assert_matches_store(app):
+    keys = app.store_keys
+    fresh = app.read_store(app.connect_store())
+    pd.testing.assert_frame_equal(app.df, fresh)
+    pd.testing.assert_series_equal(keys, app.store_keys, check_names=False)
+    expected = np.cumsum(app.band_starts(app.df, np.arange(len(app.df)))) - 1
+    np.testing.assert_array_equal(app.band_ids(app.df), expected)
+
+
+@pytest.mark.parametrize("app", ["sqlite"], indirect=True)
+def test_other_workers_commits_are_applied_row_by_row(app, client, monkeypatch):
+    source = sample_frame()
+    upload(client, source)
+    other = other_worker()
+    other_client = TestClient(other.app)
+    load_store = app.load_store
+
+    def full_reload():
+        raise AssertionError("the table was reloaded")
+
+    monkeypatch.setattr(app, "load_store", full_reload)
+    part = source.iloc[9:15].copy()
+    part["CANTIDAD"] = 77
+    part.loc[part.index[:2], "CODIGO"] = "NUEVO"
+    steps = [
+        lambda: other_client.post("/add/", json={"paciente": "PACIENTE 02", "procedimientos": [
+            {"name": "CURACION", "code": "97597", "quantity": 1}]}),
+        lambda: other_client.post("/delete/", json={"ids": [0, 1, 30]}),
+        lambda: other_client.patch("/edit/", json={"changes": [
+            {"id": 5, "column": "NOMBRE DE BENEFICIARIO", "value": "OTRO"},
+            {"id": 6, "column": "CANTIDAD", "value": 9}]}),
+        lambda: other_client.post("/upload/", params={"mode": "merge"}, files={"file": ("m.xlsx", xlsx_bytes(part))}),
+        lambda: other_client.post("/undo/"),
+        lambda: other_client.post("/undo/"),
+        lambda: other_client.post("/redo/"),
+    ]
+    for step in steps:
+        assert step().status_code == 200
+        # Catalog-only routes do not wait for the refresh
+        assert client.get("/search/", params={"query": "cur"}).status_code == 200
+        assert app.store_version != other.store_version
+        assert client.get("/data/").json() == other_client.get("/data/").json()
+        assert app.store_version == other.store_version
+        assert client.get("/duplicates/").json() == other_client.get("/duplicates/").json()
+        assert_matches_store(app)
+
+    # A replace upload rewrites the whole table, so the others reload it
+    monkeypatch.setattr(app, "load_store", load_store)
+    upload(other_client, sample_frame(patients=3))
+    assert client.get("/data/").json() == other_client.get("/data/").json()
+    assert_matches_store(app)
+    other.close_store()
@@ -0,0 +1,71 @@
+import io
+import time
+import asyncio
+import threading
+
+import pandas as pd
+from fastapi import UploadFile
+
+from conftest import sample_frame, upload, xlsx_bytes
+
+
+def test_merge_updates_matches_and_inserts_the_rest(app, client):
+    source = sample_frame(patients=3)
+    upload(client, source)
+    part = source.iloc[9:12].copy()
+    part["CANTIDAD"] = 77
+    extra = part.iloc[[0]].assign(CODIGO="NUEVO")
+    result = upload(client, pd.concat([part, extra, source.iloc[[20]]]), mode="merge")
+    assert (result["inserted"], result["updated"], result["unchanged"]) == (1, 3, 1)
+    assert len(app.df) == 28
+    assert app.df["CANTIDAD"].iloc[9:12].tolist() == [77] * 3
+    # The unmatched line goes after the last row of its patient
+    assert app.df[["NOMBRE DE BENEFICIARIO", "CODIGO"]].iloc[18].tolist() == ["PACIENTE 01", "NUEVO"]
+    assert app.df["CANTIDAD"].iloc[19:].tolist() == source["CANTIDAD"].iloc[18:].tolist()
+
+
+def test_failed_merge_leaves_the_data_untouched(app, client, monkeypatch):
+    source = sample_frame(patients=3)
+    upload(client, source)
+    before = app.df.copy()
+    version = app.data_version
+
+    def broken_insert(*args, **kwargs):
+        raise MemoryError("insert failed")
+
+    # Fails after the matched rows have been updated
+    monkeypatch.setattr(app, "insert_rows", broken_insert)
+    part = source.iloc[9:12].assign(CANTIDAD=77)
+    extra = part.iloc[[0]].assign(CODIGO="NUEVO")
+    response = client.post("/upload/", params={"mode": "merge"}, files={"file": ("month.xlsx", xlsx_bytes(pd.concat([part, extra])))})
+    assert response.status_code == 500
+    pd.testing.assert_frame_equal(app.df, before)
+    assert app.data_version == version
+
+
+def test_upload_waits_for_the_lock_off_the_event_loop(app):
+    # Another request holds data_lock for half a second while the upload runs
+    # on this loop; a ticker on the same loop must keep running meanwhile
+    held = threading.Event()
+
+    def hold_lock():
+        with app.data_lock:
+            held.set()
+            time.sleep(0.5)
+
+    async def scenario():
+        threading.Thread(target=hold_lock).start()
+        held.wait()
+        upload = asyncio.create_task(app.upload_file(
+            UploadFile(io.BytesIO(xlsx_bytes(sample_frame())), filename="month.xlsx"), mode="replace"
+        ))
+        ticks = [time.perf_counter()]
+        while not upload.done():
+            await asyncio.sleep(0.01)
+            ticks.append(time.perf_counter())
+        return await upload, max(b - a for a, b in zip(ticks, ticks[1:]))
+
+    result, longest_gap = asyncio.run(scenario())
+    assert "duplicate_groups" in result
+    assert len(app.df) == len(sample_frame())
+    assert longest_gap < 0.25